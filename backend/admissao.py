@@ -0,0 +1,409 @@
+# admissao.py - Controle de admissão e escalonamento justo por cliente
+#
+# As rotas pesadas (visão/STL) e as leves têm orçamentos de concorrência
+# separados, então um pico de processamento não atrasa cadastro e downloads.
+#   - cada cliente tem um token bucket por rota limitada: processar-imagem
+#     (ADMISSAO_TAXA_CLIENTE req/s, rajada ADMISSAO_RAJADA_CLIENTE) e
+#     corrigir-medidas, bem mais folgado (ADMISSAO_TAXA_CORRECAO, rajada
+#     ADMISSAO_RAJADA_CORRECAO); sem token a resposta é 429 com Retry-After;
+#   - a vaga pesada é ocupada só durante o trabalho de CPU (vaga_pesada nas
+#     views), depois que o upload foi lido: um cliente lento no envio não
+#     prende uma vaga nem infla a duração média usada nas estimativas;
+#   - quando uma vaga abre, entra o cliente com menos requisições em execução
+#     (depois o atendido há mais tempo), para uma clínica não monopolizar a fila;
+#   - se a espera estimada passar de ADMISSAO_PRAZO_S, a requisição é recusada
+#     na hora com 503 e Retry-After (antes mesmo de receber o upload).
+#
+# O cliente é o IP de origem (request.remote_addr). Atrás de proxies, defina
+# PROXIES_CONFIAVEIS no app.py para que o ProxyFix resolva o IP real (no modo
+# ASGI, use --proxy-headers/--forwarded-allow-ips do uvicorn); o
+# X-Forwarded-For nunca é lido diretamente. O cabeçalho X-Cliente-Id só é
+# aceito assinado: "<id>.<hmac-sha256 hex de id com ADMISSAO_CHAVE_CLIENTE>".
+#
+# Os limites valem por processo: no Flask, use workers com threads (gunicorn
+# --threads N ou o servidor de desenvolvimento); o asgi.py usa as mesmas
+# classes com espera assíncrona. GET /api/admissao mostra filas, execuções e
+# rejeições.
+import os
+import math
+import time
+import asyncio
+import threading
+import itertools
+import contextlib
+import hmac
+import hashlib
+
+from flask import g, request, jsonify
+
+# Rota -> limitador por cliente (token bucket)
+LIMITES_ROTA = {
+    '/api/processar-imagem': 'processamento',
+    '/api/corrigir-medidas': 'correcao',
+}
+# Rotas cuja vaga pesada é ocupada pela própria view, em volta do trabalho de CPU
+ROTAS_PESADAS = ('/api/processar-imagem', '/api/corrigir-medidas')
+
+ADMISSAO_PESADAS = int(os.environ.get('ADMISSAO_PESADAS', os.cpu_count() or 1))
+ADMISSAO_LEVES = int(os.environ.get('ADMISSAO_LEVES', 16))
+ADMISSAO_PRAZO_S = float(os.environ.get('ADMISSAO_PRAZO_S', 20.0))
+ADMISSAO_TAXA_CLIENTE = float(os.environ.get('ADMISSAO_TAXA_CLIENTE', 0.5))
+ADMISSAO_RAJADA_CLIENTE = float(os.environ.get('ADMISSAO_RAJADA_CLIENTE', 4))
+# Correções são ajustes rápidos e repetidos de landmarks: limite bem mais folgado
+ADMISSAO_TAXA_CORRECAO = float(os.environ.get('ADMISSAO_TAXA_CORRECAO', 5))
+ADMISSAO_RAJADA_CORRECAO = float(os.environ.get('ADMISSAO_RAJADA_CORRECAO', 30))
+# Segredo para validar X-Cliente-Id (vazio: cabeçalho ignorado)
+ADMISSAO_CHAVE_CLIENTE = os.environ.get('ADMISSAO_CHAVE_CLIENTE', '')
+
+# Estimativa inicial da duração de uma requisição, antes de haver medições
+DURACAO_INICIAL_S = {'pesada': 5.0, 'leve': 0.2}
+
+
+class RejeicaoAdmissao(Exception):
+    def __init__(self, status, mensagem, retry_after):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+        self.retry_after = retry_after
+
+    def corpo(self):
+        """(json, status, cabeçalhos) da resposta de rejeição, para Flask e ASGI."""
+        return {'erro': self.mensagem}, self.status, {'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+
+    def consumir(self):
+        """Consome um token; retorna 0 se conseguiu ou os segundos até o próximo."""
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.taxa
+
+
+class LimitadorCliente:
+    """Um token bucket por cliente para uma rota."""
+
+    def __init__(self, nome, taxa, rajada):
+        self.nome = nome
+        self.taxa = taxa
+        self.rajada = rajada
+        self._trava = threading.Lock()
+        self._buckets = {}
+        self.rejeitadas = 0
+
+    def consumir(self, cliente):
+        with self._trava:
+            bucket = self._buckets.get(cliente)
+            if bucket is None:
+                # Buckets cheios não carregam informação; descartá-los limita a memória
+                if len(self._buckets) > 10000:
+                    agora = time.monotonic()
+                    self._buckets = {
+                        chave: b for chave, b in self._buckets.items()
+                        if b.tokens + (agora - b.atualizado) * b.taxa < b.capacidade
+                    }
+                bucket = self._buckets[cliente] = TokenBucket(self.taxa, self.rajada)
+            espera = bucket.consumir()
+            if espera > 0:
+                self.rejeitadas += 1
+                raise RejeicaoAdmissao(429, 'Muitas requisições deste cliente', espera)
+
+    def estado(self):
+        with self._trava:
+            return {'taxa': self.taxa, 'rajada': self.rajada, 'clientes': len(self._buckets),
+                    'rejeitadas_taxa': self.rejeitadas}
+
+
+class ClasseAdmissao:
+    """Orçamento de concorrência de uma classe de rotas, com fila justa por cliente.
+
+    adquirir() bloqueia a thread (Flask); adquirir_async() espera sem bloquear
+    o event loop (ASGI). As duas usam a mesma fila.
+    """
+
+    def __init__(self, nome, capacidade, prazo_s):
+        self.nome = nome
+        self.capacidade = capacidade
+        self.prazo_s = prazo_s
+
+        self._condicao = threading.Condition()
+        self._senhas = itertools.count()
+        self._fila = {}  # senha -> cliente
+        self._em_execucao = {}  # cliente -> quantidade
+        self._ultima_admissao = {}  # cliente -> instante da última admissão
+        self._eventos_async = set()  # (loop, asyncio.Event) de quem espera no modo ASGI
+        self.ocupadas = 0
+        self.duracao_media_s = DURACAO_INICIAL_S.get(nome, 1.0)
+        self.contadores = {'admitidas': 0, 'rejeitadas_fila': 0, 'rejeitadas_prazo': 0}
+
+    def espera_estimada(self):
+        # Cada "rodada" libera `capacidade` vagas a cada duração média
+        return math.ceil((len(self._fila) + 1) / self.capacidade) * self.duracao_media_s \
+            if self.ocupadas >= self.capacidade else 0.0
+
+    def verificar_espera(self):
+        """Recusa (503) se a espera estimada já passa do prazo."""
+        with self._condicao:
+            estimativa = self.espera_estimada()
+            if estimativa > self.prazo_s:
+                self.contadores['rejeitadas_fila'] += 1
+                raise RejeicaoAdmissao(503, 'Servidor ocupado, tente novamente', estimativa)
+
+    def _proxima_senha(self):
+        # Cliente com menos requisições em execução, depois o atendido há mais
+        # tempo (rodízio entre clientes); empate final pela ordem de chegada
+        def prioridade(senha):
+            cliente = self._fila[senha]
+            return self._em_execucao.get(cliente, 0), self._ultima_admissao.get(cliente, 0.0), senha
+        return min(self._fila, key=prioridade)
+
+    def _notificar(self):
+        self._condicao.notify_all()
+        for loop, evento in list(self._eventos_async):
+            try:
+                loop.call_soon_threadsafe(evento.set)
+            except RuntimeError:
+                # Loop já encerrado
+                self._eventos_async.discard((loop, evento))
+
+    def _entrar_na_fila(self, cliente):
+        # Chamado com self._condicao adquirida
+        estimativa = self.espera_estimada()
+        if estimativa > self.prazo_s:
+            self.contadores['rejeitadas_fila'] += 1
+            raise RejeicaoAdmissao(503, 'Servidor ocupado, tente novamente', estimativa)
+
+        if len(self._ultima_admissao) > 10000:
+            agora = time.monotonic()
+            self._ultima_admissao = {
+                chave: instante for chave, instante in self._ultima_admissao.items()
+                if agora - instante < 10 * self.prazo_s
+            }
+        senha = next(self._senhas)
+        self._fila[senha] = cliente
+        return senha
+
+    def _tentar_admitir(self, senha, cliente):
+        # Chamado com self._condicao adquirida; retorna o instante de início ou None
+        if self.ocupadas >= self.capacidade or self._proxima_senha() != senha:
+            return None
+        del self._fila[senha]
+        self.ocupadas += 1
+        self._em_execucao[cliente] = self._em_execucao.get(cliente, 0) + 1
+        self._ultima_admissao[cliente] = inicio = time.monotonic()
+        self.contadores['admitidas'] += 1
+        # Outro cliente pode ter virado o próximo da vez
+        self._notificar()
+        return inicio
+
+    def _desistir(self, senha):
+        # Chamado com self._condicao adquirida
+        if self._fila.pop(senha, None) is not None:
+            self._notificar()
+
+    def _recusar_por_prazo(self):
+        self.contadores['rejeitadas_prazo'] += 1
+        return RejeicaoAdmissao(503, 'Tempo de espera na fila esgotado', self.espera_estimada())
+
+    def adquirir(self, cliente):
+        with self._condicao:
+            senha = self._entrar_na_fila(cliente)
+            limite = time.monotonic() + self.prazo_s
+            try:
+                while True:
+                    inicio = self._tentar_admitir(senha, cliente)
+                    if inicio is not None:
+                        return inicio
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise self._recusar_por_prazo()
+                    self._condicao.wait(restante)
+            finally:
+                self._desistir(senha)
+
+    async def adquirir_async(self, cliente):
+        aviso = (asyncio.get_running_loop(), asyncio.Event())
+        evento = aviso[1]
+        with self._condicao:
+            senha = self._entrar_na_fila(cliente)
+            self._eventos_async.add(aviso)
+        limite = time.monotonic() + self.prazo_s
+        try:
+            while True:
+                # Limpar antes de checar: um aviso chegado depois da checagem acorda a espera
+                evento.clear()
+                with self._condicao:
+                    inicio = self._tentar_admitir(senha, cliente)
+                    if inicio is not None:
+                        return inicio
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise self._recusar_por_prazo()
+                try:
+                    await asyncio.wait_for(evento.wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condicao:
+                self._eventos_async.discard(aviso)
+                self._desistir(senha)
+
+    def liberar(self, cliente, inicio):
+        with self._condicao:
+            self.ocupadas -= 1
+            restantes = self._em_execucao.get(cliente, 1) - 1
+            if restantes:
+                self._em_execucao[cliente] = restantes
+            else:
+                self._em_execucao.pop(cliente, None)
+            # Média móvel exponencial da duração, usada na estimativa de espera
+            self.duracao_media_s = 0.8 * self.duracao_media_s + 0.2 * (time.monotonic() - inicio)
+            self._notificar()
+
+    def estado(self):
+        with self._condicao:
+            return {
+                'capacidade': self.capacidade,
+                'em_execucao': self.ocupadas,
+                'na_fila': len(self._fila),
+                'clientes_ativos': len(self._em_execucao),
+                'duracao_media_s': round(self.duracao_media_s, 3),
+                'espera_estimada_s': round(self.espera_estimada(), 2),
+                **self.contadores
+            }
+
+
+classes = {
+    'pesada': ClasseAdmissao('pesada', ADMISSAO_PESADAS, ADMISSAO_PRAZO_S),
+    'leve': ClasseAdmissao('leve', ADMISSAO_LEVES, ADMISSAO_PRAZO_S),
+}
+
+limitadores = {
+    'processamento': LimitadorCliente('processamento', ADMISSAO_TAXA_CLIENTE, ADMISSAO_RAJADA_CLIENTE),
+    'correcao': LimitadorCliente('correcao', ADMISSAO_TAXA_CORRECAO, ADMISSAO_RAJADA_CORRECAO),
+}
+
+
+def validar_cliente_assinado(valor):
+    """Devolve o id de um X-Cliente-Id "<id>.<assinatura>" válido, senão None."""
+    if not ADMISSAO_CHAVE_CLIENTE or not valor or '.' not in valor:
+        return None
+    cliente, assinatura = valor.rsplit('.', 1)
+    esperada = hmac.new(ADMISSAO_CHAVE_CLIENTE.encode(), cliente.encode(), hashlib.sha256).hexdigest()
+    if cliente and hmac.compare_digest(assinatura, esperada):
+        return cliente[:64]
+    return None
+
+
+def chave_cliente(cabecalho_cliente, endereco):
+    """Cliente = X-Cliente-Id assinado, senão o IP de origem."""
+    cliente = validar_cliente_assinado(cabecalho_cliente)
+    if cliente:
+        return 'id:' + cliente
+    return endereco or 'desconhecido'
+
+
+def identificar_cliente():
+    """Cliente da requisição Flask atual (IP resolvido pelo ProxyFix)."""
+    return chave_cliente(request.headers.get('X-Cliente-Id'), request.remote_addr)
+
+
+def classificar_rota(caminho):
+    if caminho in ROTAS_PESADAS:
+        return 'pesada'
+    if caminho.startswith('/api/') and caminho != '/api/admissao':
+        return 'leve'
+    return None
+
+
+def verificar_requisicao(caminho, cliente):
+    """Checagens baratas feitas antes de ler o corpo: token bucket da rota e,
+    nas rotas pesadas, se a fila já passa do prazo. Levanta RejeicaoAdmissao."""
+    nome_limitador = LIMITES_ROTA.get(caminho)
+    if nome_limitador:
+        limitadores[nome_limitador].consumir(cliente)
+    if classificar_rota(caminho) == 'pesada':
+        classes['pesada'].verificar_espera()
+
+
+def estado_admissao():
+    return {
+        **{nome: classe.estado() for nome, classe in classes.items()},
+        'limites': {nome: limitador.estado() for nome, limitador in limitadores.items()},
+    }
+
+
+@contextlib.asynccontextmanager
+async def vaga_async(nome_classe, cliente):
+    """Ocupa uma vaga da classe enquanto o bloco roda (modo ASGI)."""
+    classe = classes[nome_classe]
+    inicio = await classe.adquirir_async(cliente)
+    try:
+        yield
+    finally:
+        classe.liberar(cliente, inicio)
+
+
+@contextlib.contextmanager
+def vaga_pesada():
+    """Ocupa uma vaga pesada só durante o trabalho de CPU da view Flask."""
+    cliente = g.get('admissao_cliente') or identificar_cliente()
+    classe = classes['pesada']
+    inicio = classe.adquirir(cliente)
+    try:
+        yield
+    finally:
+        classe.liberar(cliente, inicio)
+
+
+def resposta_rejeicao(e):
+    corpo, status, cabecalhos = e.corpo()
+    print(f"Admissão recusada ({request.path}, {g.get('admissao_cliente')}): {e.mensagem}")
+    response = jsonify(corpo)
+    response.status_code = status
+    response.headers.update(cabecalhos)
+    return response
+
+
+def admitir_requisicao():
+    if request.method == 'OPTIONS':
+        return None
+    nome_classe = classificar_rota(request.path)
+    if nome_classe is None:
+        return None
+
+    g.admissao_cliente = cliente = identificar_cliente()
+    try:
+        verificar_requisicao(request.path, cliente)
+        if nome_classe == 'leve':
+            g.admissao = (cliente, classes['leve'].adquirir(cliente))
+    except RejeicaoAdmissao as e:
+        return resposta_rejeicao(e)
+    return None
+
+
+def liberar_requisicao(excecao=None):
+    admissao = g.pop('admissao', None)
+    if admissao is not None:
+        cliente, inicio = admissao
+        classes['leve'].liberar(cliente, inicio)
+
+
+def registrar_admissao(app):
+    """Instala o controle de admissão e a rota /api/admissao no app Flask."""
+    app.before_request(admitir_requisicao)
+    app.teardown_request(liberar_requisicao)
+    app.register_error_handler(RejeicaoAdmissao, resposta_rejeicao)
+
+    @app.route('/api/admissao', methods=['GET'])
+    def estado_admissao_rota():
+        return jsonify(estado_admissao())
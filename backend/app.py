@@ -1,6 +1,8 @@
 import os
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 import uuid
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -12,10 +14,19 @@ from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
 import time
 import shutil
+import gzip
+import zlib
 import numpy as np
 
 app = Flask(__name__)
 
+# Número de proxies reversos confiáveis na frente do app. Com valor > 0, o
+# ProxyFix usa o X-Forwarded-For deixado por eles como request.remote_addr
+# (o controle de admissão identifica clientes por esse IP)
+PROXIES_CONFIAVEIS = int(os.environ.get('PROXIES_CONFIAVEIS', 0))
+if PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS)
+
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
 # Configurações
@@ -23,6 +34,12 @@ UPLOAD_FOLDER = '/tmp'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Limite de upload da imagem (MB); o corpo da requisição ganha uma folga
+# para os demais campos do formulário
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 15)) * 1024 * 1024)
+TAMANHO_BLOCO_UPLOAD = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + TAMANHO_BLOCO_UPLOAD
+
 # MIDDLEWARE CORS MANUAL EXTREMO
 @app.before_request
 def before_request():
@@ -37,6 +54,16 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+# Controle de admissão: orçamentos separados para rotas pesadas e leves,
+# token bucket por cliente e 503/429 com Retry-After (estado em /api/admissao).
+# Registrado antes do perfilamento para não perfilar requisições recusadas.
+from admissao import registrar_admissao, vaga_pesada, RejeicaoAdmissao
+registrar_admissao(app)
+
+# Perfilamento sob demanda (cabeçalho X-Perfil com PERFIL_TOKEN ou amostragem PERFIL_TAXA)
+from perfilamento import registrar_perfilamento
+registrar_perfilamento(app)
+
 # ROTA CATCH-ALL PARA OPTIONS
 @app.route('/', defaults={'path': ''}, methods=['OPTIONS'])
 @app.route('/<path:path>', methods=['OPTIONS'])
@@ -83,6 +110,54 @@ except Exception as e:
     print(f"Erro ao carregar módulo de processamento: {e}")
     processamento = None
 
+# Biblioteca de modelos de órtese (models/biblioteca/manifesto.json ou MODELOS_DIR),
+# carregada e validada uma vez aqui; sem manifesto, usa o modelo base acima.
+# Um manifesto inválido impede a inicialização (ValueError) de propósito.
+# Com gunicorn --preload, os workers compartilham essas malhas somente leitura.
+if processamento and hasattr(processamento, 'carregar_biblioteca_modelos'):
+    processamento.carregar_biblioteca_modelos(processamento.MODELOS_DIR, MODELO_BASE_STL_PATH)
+
+@app.errorhandler(413)
+def upload_muito_grande(e):
+    return jsonify({'erro': f'Arquivo excede o limite de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
+
+def ler_upload_limitado(stream, limite=MAX_UPLOAD_BYTES):
+    """Lê o upload em blocos, rejeitando cedo arquivos grandes ou inválidos.
+
+    Retorna (bytes, erro, status_http).
+    """
+    dados = bytearray()
+    verificar_cabecalho = processamento is not None and hasattr(processamento, 'validar_cabecalho_imagem')
+
+    while True:
+        bloco = stream.read(TAMANHO_BLOCO_UPLOAD)
+        if not bloco:
+            break
+        dados.extend(bloco)
+
+        if len(dados) > limite:
+            return None, f'Arquivo excede o limite de {limite // (1024 * 1024)} MB', 413
+
+        # Checar assinatura e dimensões assim que o cabeçalho chegar
+        # (a checagem final ocorre de novo antes do decode)
+        if verificar_cabecalho:
+            _, dimensoes, erro = processamento.validar_cabecalho_imagem(bytes(dados))
+            if erro:
+                # 413 só para o limite de pixels; cabeçalho sem dimensões válidas é 400
+                if dimensoes is None:
+                    status = 415
+                elif min(dimensoes) > 0:
+                    status = 413
+                else:
+                    status = 400
+                return None, erro, status
+            verificar_cabecalho = dimensoes is None and len(dados) < TAMANHO_BLOCO_UPLOAD * 4
+
+    if not dados:
+        return None, 'Arquivo vazio', 400
+
+    return bytes(dados), None, 200
+
 # ===== ROTAS PRINCIPAIS =====
 @app.route('/')
 def home():
@@ -101,46 +176,51 @@ def cadastrar_paciente():
         
     try:
         data = request.get_json(silent=True) or {}
-        print("Dados recebidos:", data)
-        
-        nome = data.get('nome', '').strip()
-        idade = data.get('idade', '').strip()
-        email = data.get('email', '').strip()
+        resultado, status = registrar_paciente(data)
+        return jsonify(resultado), status
 
-        if not nome or not idade:
-            return jsonify({'erro': 'Nome e idade são obrigatórios'}), 400
+    except Exception as e:
+        print(f"Erro no cadastro: {str(e)}")
+        return jsonify({'erro': f'Erro no servidor: {str(e)}'}), 500
 
-        # ID único
-        paciente_id = 'P' + str(uuid.uuid4())[:8].upper()
-        print(f"Novo paciente: {nome} - ID: {paciente_id}")
+def registrar_paciente(data):
+    """Cadastra o paciente e gera QR code e folha padrão. Retorna (dict, status)."""
+    print("Dados recebidos:", data)
+    
+    nome = data.get('nome', '').strip()
+    idade = data.get('idade', '').strip()
+    email = data.get('email', '').strip()
 
-        # QR Code
-        qr = qrcode.QRCode(version=1, box_size=10, border=4)
-        qr.add_data(paciente_id)
-        qr.make(fit=True)
-        
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        qr_buffer = BytesIO()
-        qr_img.save(qr_buffer, format='PNG')
-        qr_buffer.seek(0)
-        qr_base64 = base64.b64encode(qr_buffer.getvalue()).decode('utf-8')
+    if not nome or not idade:
+        return {'erro': 'Nome e idade são obrigatórios'}, 400
 
-        # Gerar folha padrão
-        folha_path = os.path.join(app.config['UPLOAD_FOLDER'], f'folha_{paciente_id}.pdf')
-        if gerar_folha_padrao(paciente_id, nome, idade, folha_path):
-            return jsonify({
-                'sucesso': True,
-                'paciente_id': paciente_id,
-                'qr_code': f'data:image/png;base64,{qr_base64}',
-                'folha_padrao_url': f'/api/baixar-folha/{paciente_id}',
-                'mensagem': 'Paciente cadastrado com sucesso'
-            })
-        else:
-            return jsonify({'erro': 'Erro ao gerar folha padrão'}), 500
+    # ID único
+    paciente_id = 'P' + str(uuid.uuid4())[:8].upper()
+    print(f"Novo paciente: {nome} - ID: {paciente_id}")
 
-    except Exception as e:
-        print(f"Erro no cadastro: {str(e)}")
-        return jsonify({'erro': f'Erro no servidor: {str(e)}'}), 500
+    # QR Code
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(paciente_id)
+    qr.make(fit=True)
+    
+    qr_img = qr.make_image(fill_color="black", back_color="white")
+    qr_buffer = BytesIO()
+    qr_img.save(qr_buffer, format='PNG')
+    qr_buffer.seek(0)
+    qr_base64 = base64.b64encode(qr_buffer.getvalue()).decode('utf-8')
+
+    # Gerar folha padrão
+    folha_path = os.path.join(app.config['UPLOAD_FOLDER'], f'folha_{paciente_id}.pdf')
+    if gerar_folha_padrao(paciente_id, nome, idade, folha_path):
+        return {
+            'sucesso': True,
+            'paciente_id': paciente_id,
+            'qr_code': f'data:image/png;base64,{qr_base64}',
+            'folha_padrao_url': f'/api/baixar-folha/{paciente_id}',
+            'mensagem': 'Paciente cadastrado com sucesso'
+        }, 200
+    else:
+        return {'erro': 'Erro ao gerar folha padrão'}, 500
 
 def gerar_folha_padrao(paciente_id, nome, idade, output_path):
     try:
@@ -247,6 +327,23 @@ def baixar_folha(paciente_id):
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+@app.route('/api/config-entrada', methods=['GET'])
+def config_entrada():
+    """Parâmetros de entrada que o frontend usa para reduzir a foto antes do upload."""
+    return jsonify(obter_config_entrada())
+
+def obter_config_entrada():
+    # Maior lado com que o backend analisa a imagem: acima dele a resolução extra
+    # não melhora as medidas (a partir do dobro, o decode já reduz 1/2, 1/4 ou 1/8)
+    max_dim = getattr(processamento, 'MAX_DIM_ENTRADA', 2000) if processamento else 2000
+    return {
+        'max_dim_entrada': max_dim,
+        'max_upload_bytes': MAX_UPLOAD_BYTES,
+        'formatos': ['image/jpeg', 'image/png', 'image/webp', 'image/bmp'],
+        'formato_preferido': 'image/jpeg',
+        'qualidade_jpeg': 0.9
+    }
+
 @app.route('/api/processar-imagem', methods=['POST', 'OPTIONS'])
 
 def processar_imagem():
@@ -260,38 +357,91 @@ def processar_imagem():
         arquivo = request.files['imagem']
         paciente_id = request.form.get('paciente_id', '')
         modo_manual = request.form.get('modo_manual', 'false').lower() == 'true'
+        modo_bilateral = request.form.get('modo_bilateral', 'false').lower() == 'true'
+        overlay_cliente = request.form.get('overlay_cliente', 'false').lower() == 'true'
 
         if arquivo.filename == '':
             return jsonify({'erro': 'Nome de arquivo vazio'}), 400
 
         print(f"Processando imagem para paciente: {paciente_id}")
 
-        # Ler imagem
-        imagem_bytes = arquivo.read()
+        # Ler imagem em blocos, com limite de tamanho e checagem do cabeçalho
+        imagem_bytes, erro, status = ler_upload_limitado(arquivo.stream)
+        if erro:
+            print(f"Upload rejeitado: {erro}")
+            return jsonify({'erro': erro}), status
         
-        # Processamento real (agora com fallbacks internos)
-        if processamento and hasattr(processamento, 'processar_imagem_ortese_api'):
-            print("Usando processamento REAL com fallbacks...")
-            resultado = processamento.processar_imagem_ortese_api(
-                imagem_bytes, 
-                modo_manual,
-                MODELO_BASE_STL_PATH
-            )
-            
-            if resultado.get('sucesso'):
-                print(f"Processamento REAL bem-sucedido! Tipo: {resultado.get('tipo_processamento', 'desconhecido')}")
-                return jsonify(resultado)
-            else:
-                print(f"Processamento REAL falhou: {resultado.get('erro', 'Erro desconhecido')}")
-                return jsonify(resultado)
-        else:
-            print("Módulo não disponível")
-            return jsonify({'erro': 'Módulo de processamento não disponível'})
+        # Vaga pesada só para o trabalho de CPU, com o upload já recebido
+        with vaga_pesada():
+            resultado = executar_processamento(imagem_bytes, modo_manual, modo_bilateral, overlay_cliente)
+        return jsonify(resultado)
         
+    except RequestEntityTooLarge as e:
+        return upload_muito_grande(e)
+    except RejeicaoAdmissao:
+        raise
     except Exception as e:
         print(f"Erro no processamento: {str(e)}")
         return jsonify({'erro': f'Erro no processamento: {str(e)}'}), 500
 
+@app.route('/api/corrigir-medidas', methods=['POST', 'OPTIONS'])
+def corrigir_medidas():
+    """Recalcula as medidas de uma sessão do modo manual com landmarks/escala ajustados."""
+    if request.method == 'OPTIONS':
+        return '', 200
+        
+    try:
+        data = request.get_json(silent=True) or {}
+        with vaga_pesada():
+            resultado, status = executar_correcao(data)
+        return jsonify(resultado), status
+        
+    except RejeicaoAdmissao:
+        raise
+    except Exception as e:
+        print(f"Erro na correção: {str(e)}")
+        return jsonify({'erro': f'Erro na correção: {str(e)}'}), 500
+
+def executar_correcao(data):
+    """Corpo: {sessao_id, landmarks: lista de 21 [x, y] ou {indice: [x, y]}, escala_px_cm, overlay_cliente}."""
+    if not processamento or not hasattr(processamento, 'recalcular_medidas_api'):
+        return {'erro': 'Módulo de processamento não disponível'}, 500
+    if not isinstance(data, dict):
+        return {'erro': 'Corpo JSON deve ser um objeto'}, 400
+    if not data.get('sessao_id'):
+        return {'erro': 'sessao_id é obrigatório'}, 400
+
+    resultado = processamento.recalcular_medidas_api(
+        data['sessao_id'],
+        data.get('landmarks'),
+        data.get('escala_px_cm'),
+        MODELO_BASE_STL_PATH,
+        bool(data.get('overlay_cliente'))
+    )
+    return resultado, 200 if resultado.get('sucesso') else 400
+
+def executar_processamento(imagem_bytes, modo_manual=False, modo_bilateral=False, overlay_cliente=False):
+    """Roda o pipeline de visão/STL sobre os bytes já validados do upload."""
+    # Processamento real (agora com fallbacks internos)
+    if processamento and hasattr(processamento, 'processar_imagem_ortese_api'):
+        print("Usando processamento REAL com fallbacks...")
+        resultado = processamento.processar_imagem_ortese_api(
+            imagem_bytes, 
+            modo_manual,
+            MODELO_BASE_STL_PATH,
+            modo_bilateral,
+            overlay_cliente
+        )
+        
+        if resultado.get('sucesso'):
+            print(f"Processamento REAL bem-sucedido! Tipo: {resultado.get('tipo_processamento', 'desconhecido')}")
+        else:
+            print(f"Processamento REAL falhou: {resultado.get('erro', 'Erro desconhecido')}")
+        return resultado
+    else:
+        print("Módulo não disponível")
+        return {'erro': 'Módulo de processamento não disponível'}
+
 def processamento_simulado_com_stl(paciente_id):
     """Simulação de processamento que inclui geração de STL"""
     import random
@@ -401,11 +551,69 @@ def processamento_simulado():
         'tipo_processamento': 'simulado'  # Para debug
     }
 
+# Variantes pré-comprimidas ficam ao lado do artefato (arquivo.stl.gz, arquivo.stl.zz)
+EXTENSOES_COMPRESSAO = {'gzip': '.gz', 'deflate': '.zz'}
+
+def escolher_codificacao(accept_encoding):
+    """Escolhe gzip ou deflate conforme o Accept-Encoding (respeitando q=0)."""
+    aceitas = {}
+    for parte in (accept_encoding or '').split(','):
+        nome, _, parametros = parte.strip().partition(';')
+        qualidade = 1.0
+        if parametros.strip().startswith('q='):
+            try:
+                qualidade = float(parametros.strip()[2:])
+            except ValueError:
+                qualidade = 0.0
+        aceitas[nome.strip().lower()] = qualidade
+
+    for codificacao in ('gzip', 'deflate'):
+        if aceitas.get(codificacao, aceitas.get('*', 0.0)) > 0:
+            return codificacao
+    return None
+
+def obter_variante_comprimida(caminho, codificacao):
+    """Devolve o caminho da variante comprimida, gerando-a só se não existir ou estiver velha."""
+    caminho_comprimido = caminho + EXTENSOES_COMPRESSAO[codificacao]
+    if os.path.exists(caminho_comprimido) and os.path.getmtime(caminho_comprimido) >= os.path.getmtime(caminho):
+        return caminho_comprimido
+
+    with open(caminho, 'rb') as f:
+        dados = f.read()
+    if codificacao == 'gzip':
+        comprimido = gzip.compress(dados, compresslevel=6, mtime=0)
+    else:
+        comprimido = zlib.compress(dados, 6)
+
+    # Escrita atômica: downloads simultâneos nunca veem um arquivo pela metade
+    temporario = f"{caminho_comprimido}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temporario, 'wb') as f:
+        f.write(comprimido)
+    os.replace(temporario, caminho_comprimido)
+    print(f"Variante {codificacao} criada: {caminho_comprimido} ({len(dados)} -> {len(comprimido)} bytes)")
+    return caminho_comprimido
+
+def enviar_artefato(caminho, download_name, mimetype, comprimir=True):
+    """Envia o arquivo, usando a variante gzip/deflate se o cliente aceitar."""
+    codificacao = escolher_codificacao(request.headers.get('Accept-Encoding')) if comprimir else None
+    if codificacao:
+        response = send_file(
+            obter_variante_comprimida(caminho, codificacao),
+            as_attachment=True,
+            download_name=download_name,
+            mimetype=mimetype
+        )
+        response.headers['Content-Encoding'] = codificacao
+    else:
+        response = send_file(caminho, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/api/download-stl/<filename>', methods=['GET'])
 def download_stl(filename):
-    """Faz download do arquivo STL gerado."""
+    """Faz download do arquivo STL gerado (comprimido se o cliente aceitar)."""
     try:
-        stl_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        stl_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(filename))
         
         print(f"Tentando fazer download do arquivo: {stl_path}")
         
@@ -413,12 +621,7 @@ def download_stl(filename):
             file_size = os.path.getsize(stl_path)
             print(f"Arquivo encontrado: {stl_path} ({file_size} bytes)")
             
-            return send_file(
-                stl_path,
-                as_attachment=True,
-                download_name=f'ortese_personalizada.stl',
-                mimetype='application/vnd.ms-pki.stl'
-            )
+            return enviar_artefato(stl_path, 'ortese_personalizada.stl', 'application/vnd.ms-pki.stl')
         else:
             print(f"Arquivo não encontrado: {stl_path}")
             files_in_dir = os.listdir(app.config['UPLOAD_FOLDER'])
@@ -430,6 +633,26 @@ def download_stl(filename):
         print(f"Erro no download: {str(e)}")
         return jsonify({'erro': f'Erro no download: {str(e)}'}), 500
 
+@app.route('/api/download-3mf/<filename>', methods=['GET'])
+def download_3mf(filename):
+    """Faz download da órtese em 3MF (já é um zip, não passa por nova compressão).
+
+    O 3MF é gerado a partir do STL no primeiro download e reaproveitado depois.
+    """
+    try:
+        caminho = None
+        if filename.endswith('.3mf') and processamento and getattr(processamento, 'EXPORTAR_3MF', False):
+            stl_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.splitext(os.path.basename(filename))[0] + '.stl')
+            caminho = processamento.obter_3mf(stl_path)
+        if not caminho:
+            return jsonify({'erro': 'Arquivo 3MF não encontrado'}), 404
+        
+        return enviar_artefato(caminho, 'ortese_personalizada.3mf', 'model/3mf', comprimir=False)
+        
+    except Exception as e:
+        print(f"Erro no download: {str(e)}")
+        return jsonify({'erro': f'Erro no download: {str(e)}'}), 500
+
 
 @app.route('/api/teste-processamento', methods=['GET'])
 def teste_processamento():
@@ -0,0 +1,309 @@
+# asgi.py - Modo de servidor assíncrono (ASGI) com as mesmas rotas do app.py
+#
+# Uso (a partir da pasta backend/):
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+#
+# Uploads e downloads são tratados de forma assíncrona, então clientes lentos
+# não prendem um worker. O trabalho de visão/STL roda num pool de processos
+# com ASGI_PROCESSOS workers (padrão: número de núcleos).
+#
+# O controle de admissão é o mesmo do app Flask (admissao.py): token bucket
+# por cliente e vagas leves no MiddlewareAdmissao, vaga pesada só em volta do
+# trabalho no pool, e GET /api/admissao. Atrás de proxy, rode o uvicorn com
+# --proxy-headers --forwarded-allow-ips=<IPs do proxy> para que o IP do
+# cliente seja o real.
+#
+# O perfilamento sob demanda (perfilamento.py, /api/perfis) existe só no modo
+# Flask: para perfilar, rode o app.py.
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, FileResponse
+from starlette.routing import Route
+
+import app as servidor_flask
+import admissao
+from admissao import RejeicaoAdmissao
+
+ASGI_PROCESSOS = int(os.environ.get('ASGI_PROCESSOS', os.cpu_count() or 1))
+
+executor = None
+
+
+def _processar_no_worker(imagem_bytes, modo_manual, modo_bilateral, overlay_cliente):
+    """Executado dentro do pool de processos (precisa ser função de módulo)."""
+    return servidor_flask.executar_processamento(imagem_bytes, modo_manual, modo_bilateral, overlay_cliente)
+
+
+@asynccontextmanager
+async def ciclo_de_vida(aplicacao):
+    global executor
+    # spawn, e não fork: o processo pai já tem o loop de eventos e threads do
+    # uvicorn, que não sobrevivem a um fork. O custo é que cada worker importa
+    # o app de novo e carrega a sua própria cópia da biblioteca de modelos
+    # (memória ~ ASGI_PROCESSOS x biblioteca); o compartilhamento copy-on-write
+    # só acontece no modo Flask com gunicorn --preload.
+    executor = ProcessPoolExecutor(
+        max_workers=ASGI_PROCESSOS,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    print(f"Pool de processamento iniciado com {ASGI_PROCESSOS} processos")
+    try:
+        yield
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ===== CONTROLE DE ADMISSÃO =====
+
+def cliente_da_requisicao(request):
+    endereco = request.client.host if request.client else None
+    return admissao.chave_cliente(request.headers.get('x-cliente-id'), endereco)
+
+
+def resposta_rejeicao(e):
+    corpo, status, cabecalhos = e.corpo()
+    return JSONResponse(corpo, status_code=status, headers=cabecalhos)
+
+
+class MiddlewareAdmissao:
+    """Token bucket e checagem de fila antes do corpo; vaga leve para as rotas leves.
+
+    A vaga leve é devolvida quando a resposta começa, então um download lento
+    não segura a vaga até o fim da transferência.
+    """
+
+    def __init__(self, aplicacao):
+        self.aplicacao = aplicacao
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS':
+            return await self.aplicacao(scope, receive, send)
+        caminho = scope['path']
+        nome_classe = admissao.classificar_rota(caminho)
+        if nome_classe is None:
+            return await self.aplicacao(scope, receive, send)
+
+        cliente = cliente_da_requisicao(Request(scope))
+        try:
+            admissao.verificar_requisicao(caminho, cliente)
+            if nome_classe != 'leve':
+                # A vaga pesada é ocupada pela view, depois de ler o upload
+                return await self.aplicacao(scope, receive, send)
+            classe = admissao.classes['leve']
+            inicio = await classe.adquirir_async(cliente)
+        except RejeicaoAdmissao as e:
+            print(f"Admissão recusada ({caminho}, {cliente}): {e.mensagem}")
+            return await resposta_rejeicao(e)(scope, receive, send)
+
+        liberada = False
+
+        def liberar():
+            nonlocal liberada
+            if not liberada:
+                liberada = True
+                classe.liberar(cliente, inicio)
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                liberar()
+            await send(mensagem)
+
+        try:
+            await self.aplicacao(scope, receive, enviar)
+        finally:
+            liberar()
+
+
+async def estado_admissao(request):
+    return JSONResponse(admissao.estado_admissao())
+
+
+# ===== ROTAS PRINCIPAIS =====
+async def home(request):
+    return JSONResponse({
+        "message": "API de Geração de Órteses Online",
+        "status": "online",
+        "version": "2.0",
+        "cors": "enabled",
+        "modo": "asgi"
+    })
+
+
+async def cadastrar_paciente(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        resultado, status = await run_in_threadpool(servidor_flask.registrar_paciente, data or {})
+        return JSONResponse(resultado, status_code=status)
+
+    except Exception as e:
+        print(f"Erro no cadastro: {str(e)}")
+        return JSONResponse({'erro': f'Erro no servidor: {str(e)}'}, status_code=500)
+
+
+async def baixar_folha(request):
+    paciente_id = os.path.basename(request.path_params['paciente_id'])
+    folha_path = os.path.join(servidor_flask.UPLOAD_FOLDER, f'folha_{paciente_id}.pdf')
+    if os.path.exists(folha_path):
+        return FileResponse(folha_path, filename=f'folha_{paciente_id}.pdf')
+    return JSONResponse({'erro': 'Folha não encontrada'}, status_code=404)
+
+
+async def config_entrada(request):
+    return JSONResponse(servidor_flask.obter_config_entrada())
+
+
+async def processar_imagem(request):
+    try:
+        # Rejeitar antes de receber o corpo se o tamanho declarado passar do limite
+        tamanho = request.headers.get('content-length')
+        if tamanho is None:
+            return JSONResponse({'erro': 'Content-Length obrigatório'}, status_code=411)
+        if not tamanho.strip().isdigit():
+            return JSONResponse({'erro': 'Content-Length inválido'}, status_code=400)
+        if int(tamanho) > servidor_flask.app.config['MAX_CONTENT_LENGTH']:
+            return erro_upload_muito_grande()
+
+        async with request.form() as formulario:
+            arquivo = formulario.get('imagem')
+            if arquivo is None or not hasattr(arquivo, 'file'):
+                return JSONResponse({'erro': 'Nenhuma imagem enviada'}, status_code=400)
+            if not arquivo.filename:
+                return JSONResponse({'erro': 'Nome de arquivo vazio'}, status_code=400)
+
+            paciente_id = formulario.get('paciente_id', '')
+            modo_manual = str(formulario.get('modo_manual', 'false')).lower() == 'true'
+            modo_bilateral = str(formulario.get('modo_bilateral', 'false')).lower() == 'true'
+            overlay_cliente = str(formulario.get('overlay_cliente', 'false')).lower() == 'true'
+            print(f"Processando imagem para paciente: {paciente_id}")
+
+            imagem_bytes, erro, status = await run_in_threadpool(servidor_flask.ler_upload_limitado, arquivo.file)
+            if erro:
+                print(f"Upload rejeitado: {erro}")
+                return JSONResponse({'erro': erro}, status_code=status)
+
+        # Vaga pesada só enquanto o pool processa, com o upload já recebido
+        loop = asyncio.get_running_loop()
+        async with admissao.vaga_async('pesada', cliente_da_requisicao(request)):
+            resultado = await loop.run_in_executor(executor, _processar_no_worker, imagem_bytes, modo_manual,
+                                                 modo_bilateral, overlay_cliente)
+        return JSONResponse(resultado)
+
+    except RejeicaoAdmissao as e:
+        return resposta_rejeicao(e)
+    except Exception as e:
+        print(f"Erro no processamento: {str(e)}")
+        return JSONResponse({'erro': f'Erro no processamento: {str(e)}'}, status_code=500)
+
+
+async def corrigir_medidas(request):
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        # Só recalcula medidas, desenho e STL: leve o bastante para o pool de threads
+        async with admissao.vaga_async('pesada', cliente_da_requisicao(request)):
+            resultado, status = await run_in_threadpool(servidor_flask.executar_correcao, data or {})
+        return JSONResponse(resultado, status_code=status)
+
+    except RejeicaoAdmissao as e:
+        return resposta_rejeicao(e)
+    except Exception as e:
+        print(f"Erro na correção: {str(e)}")
+        return JSONResponse({'erro': f'Erro na correção: {str(e)}'}, status_code=500)
+
+
+def erro_upload_muito_grande():
+    limite_mb = servidor_flask.MAX_UPLOAD_BYTES // (1024 * 1024)
+    return JSONResponse({'erro': f'Arquivo excede o limite de {limite_mb} MB'}, status_code=413)
+
+
+async def enviar_artefato(request, caminho, download_name, mimetype, comprimir=True):
+    """Envia o arquivo em blocos, usando a variante gzip/deflate se o cliente aceitar."""
+    cabecalhos = {'Vary': 'Accept-Encoding'}
+    codificacao = servidor_flask.escolher_codificacao(request.headers.get('accept-encoding')) if comprimir else None
+    if codificacao:
+        caminho = await run_in_threadpool(servidor_flask.obter_variante_comprimida, caminho, codificacao)
+        cabecalhos['Content-Encoding'] = codificacao
+    return FileResponse(caminho, filename=download_name, media_type=mimetype, headers=cabecalhos)
+
+
+async def download_stl(request):
+    """Faz download do arquivo STL gerado (enviado em blocos, sem bloquear)."""
+    filename = os.path.basename(request.path_params['filename'])
+    stl_path = os.path.join(servidor_flask.UPLOAD_FOLDER, filename)
+    if not os.path.exists(stl_path):
+        print(f"Arquivo não encontrado: {stl_path}")
+        return JSONResponse({'erro': 'Arquivo STL não encontrado'}, status_code=404)
+
+    return await enviar_artefato(request, stl_path, 'ortese_personalizada.stl', 'application/vnd.ms-pki.stl')
+
+
+async def download_3mf(request):
+    """Faz download do 3MF, gerado a partir do STL no primeiro acesso."""
+    filename = os.path.basename(request.path_params['filename'])
+    processamento = servidor_flask.processamento
+    caminho = None
+    if filename.endswith('.3mf') and processamento and getattr(processamento, 'EXPORTAR_3MF', False):
+        stl_path = os.path.join(servidor_flask.UPLOAD_FOLDER, os.path.splitext(filename)[0] + '.stl')
+        caminho = await run_in_threadpool(processamento.obter_3mf, stl_path)
+    if not caminho:
+        return JSONResponse({'erro': 'Arquivo 3MF não encontrado'}, status_code=404)
+
+    return await enviar_artefato(request, caminho, 'ortese_personalizada.3mf', 'model/3mf', comprimir=False)
+
+
+async def teste_processamento(request):
+    processamento = servidor_flask.processamento
+    if processamento is None:
+        return JSONResponse({"status": "erro", "mensagem": "Módulo de processamento não carregado"})
+
+    funcoes = [func for func in dir(processamento) if not func.startswith('_')]
+    return JSONResponse({
+        "status": "sucesso",
+        "modulo_carregado": True,
+        "funcoes_disponiveis": funcoes,
+        "processos": ASGI_PROCESSOS
+    })
+
+
+rotas = [
+    Route('/', home),
+    Route('/api/cadastrar-paciente', cadastrar_paciente, methods=['POST']),
+    Route('/api/baixar-folha/{paciente_id}', baixar_folha, methods=['GET']),
+    Route('/api/config-entrada', config_entrada, methods=['GET']),
+    Route('/api/processar-imagem', processar_imagem, methods=['POST']),
+    Route('/api/corrigir-medidas', corrigir_medidas, methods=['POST']),
+    Route('/api/download-stl/{filename}', download_stl, methods=['GET']),
+    Route('/api/download-3mf/{filename}', download_3mf, methods=['GET']),
+    Route('/api/teste-processamento', teste_processamento, methods=['GET']),
+    Route('/api/admissao', estado_admissao, methods=['GET']),
+]
+
+app = Starlette(
+    routes=rotas,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(MiddlewareAdmissao),
+    ],
+    lifespan=ciclo_de_vida
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    print(f"Servidor ASGI iniciando na porta {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,403 @@
+# benchmark_processamento.py - Benchmark reprodutível do pipeline de processamento
+#
+# Gera folhas padrão sintéticas (mesma geometria de gerar_folha_padrao: quadrado
+# azul de 6 cm a 20 pt da margem, QR no centro), aplica perspectiva, ruído e
+# variações de resolução, e mede as etapas que não dependem de uma mão na foto
+# (decode, quadrado azul, dimensões, desenho, STL). A folha sintética não tem
+# mão, então o MediaPipe e a chamada completa só são medidos nas amostras.
+#
+# Checagens: escala_px_cm detectada contra a escala conhecida e, como teste de
+# consistência da conversão px -> cm (não de precisão da detecção), dimensões
+# de landmarks sintéticos posicionados com a escala esperada.
+#
+# Amostras: fotos reais de mãos sobre a folha com as medidas esperadas em
+# manifesto.json (--amostras, padrão backend/amostras/). Cada foto passa pelo
+# MediaPipe e pela chamada completa de processar_imagem_ortese_api, que precisa
+# responder com sucesso; a primeira foto é usada no teste de concorrência. Sem
+# amostras, essas medições são puladas (com aviso) em vez de medir o caminho de
+# erro "mão não encontrada".
+#
+# Uso (a partir da pasta backend/):
+#   python benchmark_processamento.py --dpis 100 200 300 --concorrencia 1 2 4
+#   python benchmark_processamento.py --amostras fotos/ --saida resultado.json
+#
+# O processo termina com código 1 se alguma checagem falhar.
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import processamento_api as processamento
+
+CM_POR_POLEGADA = 2.54
+A4_CM = (21.0, 29.7)
+MARGEM_CM = 20 / 28.3464567  # margem de 20 pt usada em gerar_folha_padrao
+AZUL_FOLHA_BGR = (254, 0, 0)  # #0000FE
+AMOSTRAS_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'amostras')
+
+TOLERANCIA_ESCALA = 0.03
+TOLERANCIA_DIMENSOES = 0.05
+
+# Mão sintética (cm): distância 5-17 e comprimento 0-12
+BASE_5_17_CM = 6.0
+COMPRIMENTO_0_12_CM = 18.0
+
+
+def renderizar_folha(dpi, semente=0):
+    """Desenha a folha padrão em BGR na resolução pedida.
+
+    Retorna (imagem, escala_px_cm esperada).
+    """
+    px_cm = dpi / CM_POR_POLEGADA
+    largura, altura = int(A4_CM[0] * px_cm), int(A4_CM[1] * px_cm)
+    folha = np.full((altura, largura, 3), 255, np.uint8)
+
+    margem = int(round(MARGEM_CM * px_cm))
+    lado = int(round(processamento.TAMANHO_QUADRADO_CM * px_cm))
+    cv.rectangle(folha, (margem, margem), (margem + lado - 1, margem + lado - 1), AZUL_FOLHA_BGR, -1)
+
+    # QR code (módulos pretos sobre o azul, 70% do quadrado)
+    rng = np.random.default_rng(semente)
+    modulos = 25
+    lado_qr = int(lado * 0.7)
+    qr = (rng.random((modulos, modulos)) < 0.5).astype(np.uint8)
+    qr = cv.resize(qr, (lado_qr, lado_qr), interpolation=cv.INTER_NEAREST)
+    inicio = margem + (lado - lado_qr) // 2
+    regiao = folha[inicio:inicio + lado_qr, inicio:inicio + lado_qr]
+    regiao[qr == 1] = 0
+
+    # Régua de 10 cm no canto inferior direito
+    y_regua = altura - margem - int(0.7 * px_cm)
+    x_regua = largura - margem - int(10 * px_cm)
+    cv.line(folha, (x_regua, y_regua), (x_regua + int(10 * px_cm), y_regua), (0, 0, 0), max(1, dpi // 100))
+    for i in range(11):
+        x = x_regua + int(i * px_cm)
+        cv.line(folha, (x, y_regua), (x, y_regua - int((0.4 if i % 5 == 0 else 0.2) * px_cm)), (0, 0, 0), 1)
+
+    return folha, px_cm
+
+
+def renderizar_folha_pdf(dpi):
+    """Rasteriza o PDF real de gerar_folha_padrao (requer PyMuPDF)."""
+    import fitz
+    import app as servidor_flask
+
+    caminho = os.path.join(servidor_flask.UPLOAD_FOLDER, 'folha_benchmark.pdf')
+    if not servidor_flask.gerar_folha_padrao('PBENCH000', 'Benchmark', '30', caminho):
+        raise RuntimeError('Falha ao gerar a folha padrão')
+
+    pagina = fitz.open(caminho)[0]
+    pixmap = pagina.get_pixmap(dpi=dpi)
+    rgb = np.frombuffer(pixmap.samples, np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+    return cv.cvtColor(rgb[:, :, :3], cv.COLOR_RGB2BGR), dpi / CM_POR_POLEGADA
+
+
+def aplicar_variacoes(imagem, perspectiva=0.01, ruido=6.0, semente=0):
+    """Aplica uma leve perspectiva e ruído gaussiano."""
+    rng = np.random.default_rng(semente)
+    altura, largura = imagem.shape[:2]
+    origem = np.float32([[0, 0], [largura, 0], [largura, altura], [0, altura]])
+    deslocamento = rng.uniform(-perspectiva, perspectiva, (4, 2)) * [largura, altura]
+    destino = (origem + deslocamento).astype(np.float32)
+    matriz = cv.getPerspectiveTransform(origem, destino)
+    resultado = cv.warpPerspective(imagem, matriz, (largura, altura), borderValue=(255, 255, 255))
+
+    if ruido > 0:
+        resultado = cv.add(resultado, rng.normal(0, ruido, resultado.shape).astype(np.int16),
+                           dtype=cv.CV_8U)
+    return resultado
+
+
+def landmarks_sinteticos(imagem_shape, escala_px_cm):
+    """Landmarks normalizados de uma mão sintética com distâncias conhecidas."""
+    altura, largura = imagem_shape[:2]
+    cx, cy = largura * 0.6, altura * 0.7
+    base_px = BASE_5_17_CM * escala_px_cm
+    comprimento_px = COMPRIMENTO_0_12_CM * escala_px_cm
+
+    landmarks = [(cx / largura, cy / altura, 0.0)] * 21
+    landmarks[12] = (cx / largura, (cy - comprimento_px) / altura, 0.0)
+    landmarks[5] = ((cx - base_px / 2) / largura, (cy - comprimento_px / 2) / altura, 0.0)
+    landmarks[17] = ((cx + base_px / 2) / largura, (cy - comprimento_px / 2) / altura, 0.0)
+    return landmarks
+
+
+def cronometrar(funcao, *args, repeticoes=3):
+    """Executa a função `repeticoes` vezes; retorna (resultado, tempos em ms)."""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return resultado, tempos
+
+
+def pico_memoria(funcao, *args):
+    """Pico de memória alocada (MB) durante a função, via tracemalloc."""
+    tracemalloc.start()
+    try:
+        funcao(*args)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico / (1024 * 1024)
+
+
+def resumir(tempos):
+    return {
+        'mediana_ms': round(statistics.median(tempos), 2),
+        'min_ms': round(min(tempos), 2),
+        'max_ms': round(max(tempos), 2),
+    }
+
+
+def dentro_tolerancia(obtido, esperado, tolerancia):
+    return esperado > 0 and abs(obtido - esperado) / esperado <= tolerancia
+
+
+def medir_cenario(imagem_bytes, escala_esperada, modelo_base_path, repeticoes):
+    """Mede as etapas que não dependem da mão e confere escala e conversão px -> cm."""
+    etapas = {}
+    falhas = []
+
+    imagem, tempos = cronometrar(lambda b: processamento.decodificar_imagem(b)[0], imagem_bytes,
+                                 repeticoes=repeticoes)
+    etapas['decodificar'] = resumir(tempos)
+    if imagem is None:
+        return {'etapas': etapas, 'falhas': ['imagem não decodificada']}
+
+    # A decodificação pode reduzir a resolução; a escala esperada acompanha
+    escala_esperada *= imagem.shape[1] / ler_largura_original(imagem_bytes)
+
+    (contorno, dims_quadrado, _), tempos = cronometrar(processamento.detectar_quadrado_azul, imagem,
+                                                      repeticoes=repeticoes)
+    etapas['detectar_quadrado_azul'] = resumir(tempos)
+    etapas['detectar_quadrado_azul']['pico_mb'] = round(pico_memoria(processamento.detectar_quadrado_azul, imagem), 2)
+
+    escala = None
+    if contorno is None:
+        falhas.append('quadrado azul não detectado')
+    else:
+        _, _, w, h = dims_quadrado
+        escala = (w + h) / (2 * processamento.TAMANHO_QUADRADO_CM)
+        if not dentro_tolerancia(escala, escala_esperada, TOLERANCIA_ESCALA):
+            falhas.append(f'escala {escala:.2f} px/cm fora da tolerância (esperado {escala_esperada:.2f})')
+
+    # Landmarks posicionados com a escala esperada: confere só a consistência da
+    # conversão px -> cm com a escala detectada, não a precisão do MediaPipe
+    landmarks = landmarks_sinteticos(imagem.shape, escala_esperada)
+    dimensoes, tempos = cronometrar(processamento.calcular_dimensoes_simplificado, landmarks,
+                                    escala or escala_esperada, imagem.shape, repeticoes=repeticoes)
+    etapas['calcular_dimensoes'] = resumir(tempos)
+
+    esperadas = {
+        'Largura Pulso': BASE_5_17_CM * processamento.MULTIPLICADOR_PULSO,
+        'Largura Palma': BASE_5_17_CM * processamento.MULTIPLICADOR_PALMA,
+        'Comprimento Mao': COMPRIMENTO_0_12_CM,
+    }
+    for chave, esperado in esperadas.items():
+        if dimensoes is None or not dentro_tolerancia(dimensoes[chave], esperado, TOLERANCIA_DIMENSOES):
+            obtido = dimensoes[chave] if dimensoes else None
+            falhas.append(f'consistência: {chave} = {obtido} fora da tolerância (esperado {esperado:.2f})')
+
+    if dimensoes is not None:
+        preview, tempos = cronometrar(processamento.desenhar_medidas_simplificado, imagem, landmarks,
+                                      dimensoes, contorno, repeticoes=repeticoes)
+        etapas['desenhar_medidas'] = resumir(tempos)
+        etapas['desenhar_medidas']['pico_mb'] = round(
+            pico_memoria(processamento.desenhar_medidas_simplificado, imagem, landmarks, dimensoes, contorno), 2)
+
+        _, tempos = cronometrar(processamento.imagem_para_base64, preview, repeticoes=repeticoes)
+        etapas['imagem_para_base64'] = resumir(tempos)
+
+        if modelo_base_path:
+            saida = os.path.join(processamento.UPLOAD_FOLDER, 'benchmark_ortese.stl')
+            _, tempos = cronometrar(processamento.gerar_stl_simplificado, dimensoes, 'Right', saida,
+                                    modelo_base_path, repeticoes=repeticoes)
+            etapas['gerar_stl'] = resumir(tempos)
+
+    return {
+        'resolucao': f'{imagem.shape[1]}x{imagem.shape[0]}',
+        'escala_esperada': round(escala_esperada, 2),
+        'escala_detectada': round(escala, 2) if escala else None,
+        'dimensoes': dimensoes,
+        'etapas': etapas,
+        'falhas': falhas,
+    }
+
+
+def ler_largura_original(imagem_bytes):
+    dimensoes = processamento.ler_dimensoes_cabecalho(imagem_bytes)
+    if dimensoes is None:
+        return cv.imdecode(np.frombuffer(imagem_bytes, np.uint8), cv.IMREAD_COLOR).shape[1]
+    return dimensoes[0]
+
+
+def medir_concorrencia(imagem_bytes, modelo_base_path, niveis, requisicoes):
+    """Vazão de processar_imagem_ortese_api com N requisições simultâneas.
+
+    Só conta se todas as chamadas processarem a mão com sucesso.
+    """
+    resultados = {}
+    falhas = []
+    for nivel in niveis:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=nivel) as pool:
+            respostas = list(pool.map(
+                lambda _: processamento.processar_imagem_ortese_api(imagem_bytes, False, modelo_base_path),
+                range(requisicoes)))
+        duracao = time.perf_counter() - inicio
+        sem_sucesso = sum(1 for resposta in respostas if not resposta.get('sucesso'))
+        if sem_sucesso:
+            falhas.append(f'concorrência {nivel}: {sem_sucesso}/{requisicoes} chamadas sem sucesso')
+        resultados[str(nivel)] = {
+            'requisicoes': requisicoes,
+            'sem_sucesso': sem_sucesso,
+            'duracao_s': round(duracao, 2),
+            'requisicoes_por_s': round(requisicoes / duracao, 2),
+        }
+        print(f"  concorrência {nivel}: {requisicoes / duracao:.2f} req/s ({sem_sucesso} sem sucesso)")
+    return resultados, falhas
+
+
+def ler_manifesto_amostras(pasta):
+    """manifesto.json: [{"arquivo": "mao1.jpg", "dimensoes": {"Largura Pulso": 6.1, ...}}]"""
+    caminho = os.path.join(pasta, 'manifesto.json') if pasta else None
+    if not caminho or not os.path.exists(caminho):
+        return []
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def medir_amostras(pasta, manifesto, modelo_base_path, tolerancia, repeticoes):
+    """MediaPipe e chamada completa nas fotos do manifesto, conferindo sucesso e medidas."""
+    resultados = []
+    for item in manifesto:
+        with open(os.path.join(pasta, item['arquivo']), 'rb') as f:
+            imagem_bytes = f.read()
+
+        etapas = {}
+        falhas = []
+        imagem, _ = processamento.decodificar_imagem(imagem_bytes)
+        if imagem is not None:
+            resultados_mp, tempos = cronometrar(processamento.detectar_landmarks, imagem, repeticoes=repeticoes)
+            etapas['landmarks_mediapipe'] = resumir(tempos)
+            if not resultados_mp.multi_hand_landmarks:
+                falhas.append('MediaPipe não encontrou a mão')
+
+        resultado, tempos = cronometrar(processamento.processar_imagem_ortese_api, imagem_bytes, False,
+                                        modelo_base_path, repeticoes=repeticoes)
+        etapas['processar_imagem_ortese_api'] = resumir(tempos)
+        if not resultado.get('sucesso'):
+            # Tempo do caminho de erro não representa o pipeline: registrar como falha
+            falhas.append(f"chamada completa sem sucesso: {resultado.get('erro')}")
+        else:
+            etapas['processar_imagem_ortese_api']['pico_mb'] = round(
+                pico_memoria(processamento.processar_imagem_ortese_api, imagem_bytes, False, modelo_base_path), 2)
+
+        dimensoes = resultado.get('dimensoes')
+        for chave, esperado in item.get('dimensoes', {}).items():
+            obtido = dimensoes.get(chave) if dimensoes else None
+            if obtido is None or not dentro_tolerancia(obtido, esperado, tolerancia):
+                falhas.append(f'{chave} = {obtido} fora da tolerância (esperado {esperado})')
+
+        print(f"  {item['arquivo']}: {etapas['processar_imagem_ortese_api']['mediana_ms']} ms, "
+              f"{len(falhas)} falha(s)")
+        for falha in falhas:
+            print(f"  FALHA: {falha}")
+        resultados.append({'arquivo': item['arquivo'], 'etapas': etapas, 'dimensoes': dimensoes,
+                           'falhas': falhas, 'sucesso': bool(resultado.get('sucesso'))})
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline de processamento de órteses')
+    parser.add_argument('--dpis', type=int, nargs='+', default=[100, 200, 300],
+                        help='Resoluções da folha sintética (DPI)')
+    parser.add_argument('--concorrencia', type=int, nargs='+', default=[1, 2, 4],
+                        help='Níveis de concorrência para o teste de vazão')
+    parser.add_argument('--requisicoes', type=int, default=8, help='Requisições por nível de concorrência')
+    parser.add_argument('--repeticoes', type=int, default=3, help='Repetições por etapa')
+    parser.add_argument('--perspectiva', type=float, default=0.01, help='Deslocamento máximo dos cantos (fração)')
+    parser.add_argument('--ruido', type=float, default=6.0, help='Desvio padrão do ruído gaussiano')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--pdf-real', action='store_true', help='Rasterizar o PDF de gerar_folha_padrao (PyMuPDF)')
+    parser.add_argument('--amostras', default=AMOSTRAS_PADRAO,
+                        help='Pasta com fotos reais de mãos e manifesto.json (padrão: backend/amostras)')
+    parser.add_argument('--modelo', help='Modelo base STL (para medir a etapa de STL)')
+    parser.add_argument('--saida', help='Arquivo JSON com o relatório')
+    args = parser.parse_args()
+
+    relatorio = {'cenarios': [], 'concorrencia': {}, 'amostras': []}
+    houve_falha = False
+
+    for dpi in args.dpis:
+        print(f"Folha sintética a {dpi} DPI...")
+        if args.pdf_real:
+            folha, escala_esperada = renderizar_folha_pdf(dpi)
+        else:
+            folha, escala_esperada = renderizar_folha(dpi, args.semente)
+        # A perspectiva distorce pouco o quadrado no canto superior esquerdo
+        folha = aplicar_variacoes(folha, args.perspectiva, args.ruido, args.semente + dpi)
+        _, buffer = cv.imencode('.jpg', folha, [cv.IMWRITE_JPEG_QUALITY, 92])
+        imagem_bytes = buffer.tobytes()
+
+        cenario = medir_cenario(imagem_bytes, escala_esperada, args.modelo, args.repeticoes)
+        cenario['dpi'] = dpi
+        relatorio['cenarios'].append(cenario)
+
+        for etapa, medidas in cenario['etapas'].items():
+            pico = f", pico {medidas['pico_mb']} MB" if 'pico_mb' in medidas else ''
+            print(f"  {etapa}: {medidas['mediana_ms']} ms{pico}")
+        for falha in cenario['falhas']:
+            print(f"  FALHA: {falha}")
+        houve_falha = houve_falha or bool(cenario['falhas'])
+
+    manifesto = ler_manifesto_amostras(args.amostras)
+    if not manifesto:
+        print(f"AVISO: nenhuma amostra com mão em {args.amostras} (manifesto.json); MediaPipe, chamada "
+              f"completa e concorrência não foram medidos")
+    else:
+        print("Amostras reais...")
+        relatorio['amostras'] = medir_amostras(args.amostras, manifesto, args.modelo, TOLERANCIA_DIMENSOES,
+                                               args.repeticoes)
+        houve_falha = houve_falha or any(a['falhas'] for a in relatorio['amostras'])
+
+        if args.concorrencia:
+            primeira = relatorio['amostras'][0]
+            if not primeira['sucesso']:
+                print(f"Concorrência não medida: {primeira['arquivo']} não foi processada com sucesso")
+            else:
+                print(f"Vazão com {primeira['arquivo']}...")
+                with open(os.path.join(args.amostras, primeira['arquivo']), 'rb') as f:
+                    amostra_bytes = f.read()
+                relatorio['concorrencia'], falhas = medir_concorrencia(amostra_bytes, args.modelo,
+                                                                       args.concorrencia, args.requisicoes)
+                for falha in falhas:
+                    print(f"  FALHA: {falha}")
+                houve_falha = houve_falha or bool(falhas)
+
+    # ru_maxrss é em KB no Linux
+    relatorio['rss_maximo_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    print(f"RSS máximo do processo: {relatorio['rss_maximo_mb']} MB")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"Relatório salvo em {args.saida}")
+
+    sys.exit(1 if houve_falha else 0)
+
+
+if __name__ == '__main__':
+    main()
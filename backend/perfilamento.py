@@ -0,0 +1,195 @@
+# perfilamento.py - Perfilamento sob demanda das requisições (cProfile + tracemalloc)
+#
+# Uma requisição é perfilada quando traz o cabeçalho X-Perfil com o valor de
+# PERFIL_TOKEN ou quando cai na amostragem PERFIL_TAXA (0.0 a 1.0). Sem
+# PERFIL_TOKEN configurado, só a amostragem funciona e as rotas /api/perfis
+# ficam desativadas (o perfilamento deixa a requisição mais lenta).
+# Para cada requisição perfilada são gravados em PERFIL_DIR:
+#   <id>.prof  estatísticas do cProfile (abrir com pstats ou snakeviz)
+#   <id>.txt   resumo: funções mais caras e, com PERFIL_MEMORIA, alocações
+# Apenas os PERFIL_MAX_ARQUIVOS perfis mais recentes são mantidos.
+#
+# O cProfile só observa a thread da requisição perfilada: as demais pagam
+# apenas a leitura de um cabeçalho. Já o tracemalloc é global ao processo;
+# por isso fica desligado por padrão (PERFIL_MEMORIA=true para ligar). Quando
+# ligado, todas as requisições do worker ficam mais lentas enquanto houver um
+# perfil ativo e o diff de alocações inclui as outras threads: use-o num
+# worker dedicado (ex.: um gunicorn separado com --threads 1 e PERFIL_MEMORIA).
+#
+# Só o app Flask tem perfilamento; o asgi.py não registra estes hooks (o
+# trabalho pesado roda no pool de processos, fora do alcance do cProfile).
+import os
+import io
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+from flask import g, request, jsonify, send_file
+
+PERFIL_DIR = os.environ.get('PERFIL_DIR', '/tmp/perfis')
+PERFIL_MAX_ARQUIVOS = int(os.environ.get('PERFIL_MAX_ARQUIVOS', 50))
+PERFIL_TAXA = float(os.environ.get('PERFIL_TAXA', 0.0))
+PERFIL_TOKEN = os.environ.get('PERFIL_TOKEN', '')
+PERFIL_MEMORIA = os.environ.get('PERFIL_MEMORIA', 'false').lower() == 'true'
+CABECALHO_PERFIL = 'X-Perfil'
+
+_trava = threading.Lock()
+# tracemalloc é global ao processo: contar os perfis ativos e só pará-lo
+# quando o último terminar (e se fomos nós que o iniciamos)
+_perfis_ativos = 0
+_iniciou_tracemalloc = False
+
+
+def deve_perfilar():
+    if token_valido(aceitar_parametro=False):
+        return True
+    return PERFIL_TAXA > 0 and random.random() < PERFIL_TAXA
+
+
+def token_valido(aceitar_parametro=True):
+    if not PERFIL_TOKEN:
+        return False
+    return request.headers.get(CABECALHO_PERFIL) == PERFIL_TOKEN \
+        or (aceitar_parametro and request.args.get('token') == PERFIL_TOKEN)
+
+
+def adquirir_tracemalloc():
+    global _perfis_ativos, _iniciou_tracemalloc
+    with _trava:
+        if _perfis_ativos == 0:
+            _iniciou_tracemalloc = not tracemalloc.is_tracing()
+            if _iniciou_tracemalloc:
+                tracemalloc.start()
+        _perfis_ativos += 1
+
+
+def liberar_tracemalloc():
+    global _perfis_ativos
+    with _trava:
+        _perfis_ativos -= 1
+        if _perfis_ativos == 0 and _iniciou_tracemalloc:
+            tracemalloc.stop()
+
+
+def iniciar_perfil():
+    if not deve_perfilar():
+        return
+
+    g.perfil_snapshot = None
+    if PERFIL_MEMORIA:
+        adquirir_tracemalloc()
+    try:
+        if PERFIL_MEMORIA:
+            g.perfil_snapshot = tracemalloc.take_snapshot()
+        perfil = cProfile.Profile()
+        perfil.enable()
+    except Exception as e:
+        # Ex.: outro profiler já ativo nesta thread
+        if PERFIL_MEMORIA:
+            liberar_tracemalloc()
+        print(f"Erro iniciando perfil: {e}")
+        return
+    g.perfil_inicio = time.perf_counter()
+    g.perfil = perfil
+
+
+def finalizar_perfil(response):
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return response
+
+    perfil.disable()
+    duracao_ms = (time.perf_counter() - g.perfil_inicio) * 1000
+
+    try:
+        snapshot_final, pico = None, None
+        if g.perfil_snapshot is not None:
+            try:
+                snapshot_final = tracemalloc.take_snapshot()
+                _, pico = tracemalloc.get_traced_memory()
+            finally:
+                liberar_tracemalloc()
+        rota = request.path.strip('/').replace('/', '_') or 'raiz'
+        perfil_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{rota}_{uuid.uuid4().hex[:6]}"
+        salvar_perfil(perfil_id, perfil, g.perfil_snapshot, snapshot_final, duracao_ms, pico)
+        response.headers['X-Perfil-Id'] = perfil_id
+        print(f"Perfil gravado: {perfil_id} ({duracao_ms:.0f} ms)")
+    except Exception as e:
+        print(f"Erro gravando perfil: {e}")
+
+    return response
+
+
+def salvar_perfil(perfil_id, perfil, snapshot_inicial, snapshot_final, duracao_ms, pico):
+    os.makedirs(PERFIL_DIR, exist_ok=True)
+    base = os.path.join(PERFIL_DIR, perfil_id)
+    perfil.dump_stats(base + '.prof')
+
+    resumo = io.StringIO()
+    resumo.write(f"{request.method} {request.path}\n")
+    resumo.write(f"Duração: {duracao_ms:.1f} ms\n")
+    if pico is not None:
+        resumo.write(f"Pico de memória do processo (tracemalloc): {pico / (1024 * 1024):.2f} MB\n")
+    resumo.write("\n== Funções com maior tempo acumulado ==\n")
+    pstats.Stats(perfil, stream=resumo).sort_stats('cumulative').print_stats(30)
+    if snapshot_final is not None:
+        resumo.write("\n== Maiores alocações no processo durante a requisição ==\n")
+        resumo.write("(inclui alocações de outras threads do worker)\n")
+        for estatistica in snapshot_final.compare_to(snapshot_inicial, 'lineno')[:20]:
+            resumo.write(f"{estatistica}\n")
+
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(resumo.getvalue())
+
+    limpar_perfis_antigos()
+
+
+def listar_perfis():
+    if not os.path.isdir(PERFIL_DIR):
+        return []
+    ids = {os.path.splitext(nome)[0] for nome in os.listdir(PERFIL_DIR)
+           if nome.endswith(('.prof', '.txt'))}
+    return sorted(ids, reverse=True)
+
+
+def limpar_perfis_antigos():
+    with _trava:
+        for perfil_id in listar_perfis()[PERFIL_MAX_ARQUIVOS:]:
+            for extensao in ('.prof', '.txt'):
+                caminho = os.path.join(PERFIL_DIR, perfil_id + extensao)
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+
+
+def registrar_perfilamento(app):
+    """Instala os hooks de perfilamento e as rotas /api/perfis no app Flask."""
+    app.before_request(iniciar_perfil)
+    app.after_request(finalizar_perfil)
+
+    @app.route('/api/perfis', methods=['GET'])
+    def perfis():
+        if not token_valido():
+            return jsonify({'erro': 'Token de perfilamento inválido ou PERFIL_TOKEN não configurado'}), 403
+        return jsonify({
+            'perfis': [
+                {
+                    'id': perfil_id,
+                    'prof': f'/api/perfis/{perfil_id}.prof',
+                    'resumo': f'/api/perfis/{perfil_id}.txt'
+                }
+                for perfil_id in listar_perfis()
+            ]
+        })
+
+    @app.route('/api/perfis/<nome>', methods=['GET'])
+    def baixar_perfil(nome):
+        if not token_valido():
+            return jsonify({'erro': 'Token de perfilamento inválido ou PERFIL_TOKEN não configurado'}), 403
+        caminho = os.path.join(PERFIL_DIR, os.path.basename(nome))
+        if not nome.endswith(('.prof', '.txt')) or not os.path.exists(caminho):
+            return jsonify({'erro': 'Perfil não encontrado'}), 404
+        return send_file(caminho, as_attachment=True, download_name=os.path.basename(nome))
@@ -9,6 +9,11 @@ import base64
 import shutil
 import time
 import copy
+import threading
+import struct
+import uuid
+import json
+import zipfile
 
 # Configurações globais
 DEBUG = True
@@ -23,11 +28,221 @@ UPPER_BLUE = np.array([130, 255, 255])
 MULTIPLICADOR_PULSO = 0.9
 MULTIPLICADOR_PALMA = 1.45
 
+# Dimensão máxima da imagem de preview devolvida ao frontend
+MAX_DIM_PREVIEW = 1000
+
+# Limites de entrada: a imagem é decodificada em resolução reduzida (1/2, 1/4
+# ou 1/8) só enquanto o maior lado reduzido continuar >= MAX_DIM_ENTRADA, ou
+# seja, a redução começa a partir de 2 * MAX_DIM_ENTRADA e a imagem nunca é
+# analisada abaixo desse tamanho; acima de MAX_PIXELS_ENTRADA é rejeitada
+MAX_DIM_ENTRADA = int(os.environ.get('MAX_DIM_ENTRADA', 2000))
+MAX_PIXELS_ENTRADA = int(os.environ.get('MAX_PIXELS_ENTRADA', 60_000_000))
+
+# Sessões de correção manual: guardam o preview limpo, o quadrado e os
+# landmarks para recalcular as medidas sem repetir decode e MediaPipe
+SESSOES_DIR = os.path.join(UPLOAD_FOLDER, 'sessoes')
+SESSOES_TTL_S = int(os.environ.get('SESSOES_TTL_S', 30 * 60))
+# Intervalo mínimo entre varreduras de sessões expiradas (por processo)
+SESSOES_INTERVALO_LIMPEZA_S = 60
+_ultima_limpeza_sessoes = 0.0
+
+# Oferecer também o download em 3MF (malha indexada, zipada). O 3MF é gerado
+# a partir do STL só no primeiro download e reaproveitado depois (ver obter_3mf)
+EXPORTAR_3MF = os.environ.get('EXPORTAR_3MF', 'true').lower() == 'true'
+
+FLAGS_REDUCAO = {
+    1: cv.IMREAD_COLOR,
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8,
+}
+
+# Biblioteca de modelos de órtese por tamanho/lado (ver carregar_biblioteca_modelos).
+# Carregada uma vez na inicialização; as requisições só escalam o residual.
+MODELOS_DIR = os.environ.get('MODELOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'models', 'biblioteca'))
+TAMANHOS_ORTESE = ('P', 'M', 'G')
+# Perímetro de referência do modelo base único (fator = 2.2 * pulso / 10)
+PERIMETRO_MODELO_BASE_CM = 10.0
+_biblioteca_modelos = None
+
+# Kernel da morfologia do quadrado azul (criado uma única vez)
+KERNEL_QUADRADO = np.ones((15, 15), np.uint8)
+
+# Buffers de trabalho e detectores reutilizados por worker (um conjunto por thread)
+_buffers_locais = threading.local()
+
 # Inicializar MediaPipe
 mp_hands = mp.solutions.hands
 mp_drawing = mp.solutions.drawing_utils
 mp_drawing_styles = mp.solutions.drawing_styles
 
+def obter_buffer(nome, shape, dtype=np.uint8):
+    """Devolve um array de trabalho reutilizável da thread atual.
+
+    Cada nome guarda um bloco de memória do tamanho da maior imagem já
+    vista; pedidos menores reaproveitam o início desse bloco, evitando
+    novas alocações a cada requisição.
+    """
+    buffers = getattr(_buffers_locais, 'buffers', None)
+    if buffers is None:
+        buffers = _buffers_locais.buffers = {}
+
+    dtype = np.dtype(dtype)
+    tamanho = int(np.prod(shape)) * dtype.itemsize
+    bloco = buffers.get(nome)
+    if bloco is None or bloco.size < tamanho:
+        bloco = np.empty(tamanho, dtype=np.uint8)
+        buffers[nome] = bloco
+
+    return bloco[:tamanho].view(dtype).reshape(shape)
+
+def obter_detector_maos(max_num_hands=1):
+    """Devolve o detector MediaPipe da thread atual, criando-o só na primeira vez.
+
+    O grafo do MediaPipe não é thread-safe, então cada thread (ou processo do
+    pool) mantém o seu.
+    """
+    detectores = getattr(_buffers_locais, 'detectores', None)
+    if detectores is None:
+        detectores = _buffers_locais.detectores = {}
+
+    detector = detectores.get(max_num_hands)
+    if detector is None:
+        detector = mp_hands.Hands(static_image_mode=True, max_num_hands=max_num_hands,
+                                  min_detection_confidence=0.5)
+        detectores[max_num_hands] = detector
+    return detector
+
+def detectar_landmarks(imagem, max_num_hands=1):
+    """Roda o MediaPipe sobre a imagem BGR e devolve os resultados brutos."""
+    imagem_rgb = cv.cvtColor(imagem, cv.COLOR_BGR2RGB,
+                             dst=obter_buffer('rgb', imagem.shape))
+    return obter_detector_maos(max_num_hands).process(imagem_rgb)
+
+def identificar_formato(dados):
+    """Identifica o formato da imagem pelos primeiros bytes (assinatura)."""
+    if dados[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if dados[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if dados[:4] == b'RIFF' and dados[8:12] == b'WEBP':
+        return 'webp'
+    if dados[:2] == b'BM':
+        return 'bmp'
+    return None
+
+def ler_dimensoes_cabecalho(dados, formato=None):
+    """Lê (largura, altura) do cabeçalho sem decodificar os pixels.
+
+    Retorna None se o cabeçalho ainda não estiver completo em `dados`
+    ou não puder ser interpretado.
+    """
+    formato = formato or identificar_formato(dados)
+    try:
+        if formato == 'png':
+            if len(dados) < 24:
+                return None
+            largura, altura = struct.unpack('>II', dados[16:24])
+            return largura, altura
+
+        if formato == 'jpeg':
+            # Percorrer os marcadores até o SOFn (ignorando DHT/JPG/DAC)
+            i = 2
+            while i + 9 < len(dados):
+                if dados[i] != 0xFF:
+                    i += 1
+                    continue
+                marcador = dados[i + 1]
+                if marcador in (0xD8, 0x01) or 0xD0 <= marcador <= 0xD7 or marcador == 0xFF:
+                    i += 1 if marcador == 0xFF else 2
+                    continue
+                tamanho = struct.unpack('>H', dados[i + 2:i + 4])[0]
+                if 0xC0 <= marcador <= 0xCF and marcador not in (0xC4, 0xC8, 0xCC):
+                    altura, largura = struct.unpack('>HH', dados[i + 5:i + 9])
+                    return largura, altura
+                i += 2 + tamanho
+            return None
+
+        if formato == 'webp':
+            if len(dados) < 30:
+                return None
+            bloco = dados[12:16]
+            if bloco == b'VP8 ':
+                largura, altura = struct.unpack('<HH', dados[26:30])
+                return largura & 0x3FFF, altura & 0x3FFF
+            if bloco == b'VP8L':
+                bits = struct.unpack('<I', dados[21:25])[0]
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if bloco == b'VP8X':
+                largura = int.from_bytes(dados[24:27], 'little') + 1
+                altura = int.from_bytes(dados[27:30], 'little') + 1
+                return largura, altura
+            return None
+
+        if formato == 'bmp':
+            if len(dados) < 26:
+                return None
+            largura, altura = struct.unpack('<ii', dados[18:26])
+            return abs(largura), abs(altura)
+
+    except struct.error:
+        return None
+    return None
+
+def validar_cabecalho_imagem(dados):
+    """Valida formato e dimensões antes de qualquer etapa pesada.
+
+    Retorna (formato, dimensoes, erro); `dimensoes` pode ser None quando o
+    cabeçalho ainda não está completo em `dados`.
+    """
+    formato = identificar_formato(dados)
+    if formato is None:
+        return None, None, "Formato de imagem não suportado (use JPG, PNG, WEBP ou BMP)"
+
+    dimensoes = ler_dimensoes_cabecalho(dados, formato)
+    if dimensoes is not None:
+        largura, altura = dimensoes
+        if largura <= 0 or altura <= 0:
+            return formato, dimensoes, "Cabeçalho de imagem inválido"
+        if largura * altura > MAX_PIXELS_ENTRADA:
+            return formato, dimensoes, f"Imagem muito grande ({largura}x{altura} px)"
+
+    return formato, dimensoes, None
+
+def decodificar_imagem(imagem_bytes):
+    """Decodifica a imagem, reduzindo a resolução já no decode se necessário.
+
+    A orientação EXIF é aplicada pelo próprio OpenCV (não usamos
+    IMREAD_IGNORE_ORIENTATION). Retorna (imagem, erro).
+    """
+    formato, dimensoes, erro = validar_cabecalho_imagem(imagem_bytes)
+    if erro:
+        return None, erro
+
+    reducao = 1
+    if dimensoes is not None:
+        maior_lado = max(dimensoes)
+        while reducao < 8 and maior_lado / (reducao * 2) >= MAX_DIM_ENTRADA:
+            reducao *= 2
+        print(f"Cabeçalho {formato}: {dimensoes[0]}x{dimensoes[1]} px, redução 1/{reducao}")
+
+    nparr = np.frombuffer(imagem_bytes, np.uint8)
+    imagem = cv.imdecode(nparr, FLAGS_REDUCAO[reducao])
+    if imagem is None:
+        return None, "Não foi possível carregar a imagem"
+
+    return imagem, None
+
+def reduzir_para_preview(imagem, max_dim=MAX_DIM_PREVIEW):
+    """Cópia da imagem com o maior lado limitado a max_dim. Retorna (preview, fator)."""
+    altura, largura = imagem.shape[:2]
+    if max_dim and (altura > max_dim or largura > max_dim):
+        fator = min(max_dim/altura, max_dim/largura)
+        preview = cv.resize(imagem, (int(largura * fator), int(altura * fator)), interpolation=cv.INTER_AREA)
+        return preview, fator
+    return imagem.copy(), 1.0
+
 def imagem_para_base64(imagem):
     try:
         if imagem is None or imagem.size == 0:
@@ -35,7 +250,7 @@ def imagem_para_base64(imagem):
             
         # Redimensionar imagem se for muito grande
         altura, largura = imagem.shape[:2]
-        max_dim = 1000
+        max_dim = MAX_DIM_PREVIEW
         if altura > max_dim or largura > max_dim:
             fator = min(max_dim/altura, max_dim/largura)
             nova_altura = int(altura * fator)
@@ -55,12 +270,17 @@ def imagem_para_base64(imagem):
 
 def detectar_quadrado_azul(imagem, debug=False):
     try:
-        imagem_hsv = cv.cvtColor(imagem, cv.COLOR_BGR2HSV)
-        mascara = cv.inRange(imagem_hsv, LOWER_BLUE, UPPER_BLUE)
+        altura, largura = imagem.shape[:2]
+        
+        # Conversão, máscara e morfologia escrevem em buffers reaproveitados
+        imagem_hsv = cv.cvtColor(imagem, cv.COLOR_BGR2HSV,
+                                 dst=obter_buffer('hsv', (altura, largura, 3)))
+        mascara = cv.inRange(imagem_hsv, LOWER_BLUE, UPPER_BLUE,
+                             dst=obter_buffer('mascara', (altura, largura)))
         
-        kernel = np.ones((15, 15), np.uint8)
-        mascara = cv.morphologyEx(mascara, cv.MORPH_CLOSE, kernel, iterations=2)
-        mascara = cv.morphologyEx(mascara, cv.MORPH_OPEN, kernel, iterations=1)
+        temporario = obter_buffer('morfologia', (altura, largura))
+        cv.morphologyEx(mascara, cv.MORPH_CLOSE, KERNEL_QUADRADO, dst=temporario, iterations=2)
+        cv.morphologyEx(temporario, cv.MORPH_OPEN, KERNEL_QUADRADO, dst=mascara, iterations=1)
         
         contornos, _ = cv.findContours(mascara, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
         
@@ -159,12 +379,78 @@ def corrigir_detecao_mao(landmarks, handedness_detectado, imagem_shape):
         print(f"Erro na correção da mão: {e}")
         return handedness_detectado
 
-def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrado=None):
-    img_com_medidas = imagem.copy()
-    altura, largura = imagem.shape[:2]
+def calcular_linha_pulso(p0, p12, largura_pulso_px):
+    """Extremos da linha do pulso: perpendicular ao eixo 0->12, centrada no ponto 0."""
+    # Calcular vetor do comprimento (0->12)
+    vetor_comprimento = (p12[0] - p0[0], p12[1] - p0[1])
+    
+    # Calcular vetor perpendicular (90 graus)
+    vetor_perpendicular = (-vetor_comprimento[1], vetor_comprimento[0])
+    
+    # Normalizar o vetor perpendicular
+    norma = math.hypot(vetor_perpendicular[0], vetor_perpendicular[1])
+    if norma > 0:
+        vetor_perpendicular = (vetor_perpendicular[0]/norma, vetor_perpendicular[1]/norma)
+    
+    metade_largura = largura_pulso_px / 2
+    inicio = (p0[0] - vetor_perpendicular[0] * metade_largura, p0[1] - vetor_perpendicular[1] * metade_largura)
+    fim = (p0[0] + vetor_perpendicular[0] * metade_largura, p0[1] + vetor_perpendicular[1] * metade_largura)
+    return inicio, fim
+
+def montar_overlay(landmarks, dimensoes, contorno_quadrado, imagem_shape):
+    """Geometria das medidas em JSON compacto para o frontend desenhar o overlay.
+
+    Coordenadas normalizadas (0-1) em relação à imagem analisada, para que o
+    navegador as aplique sobre a foto local em qualquer resolução.
+    """
+    altura, largura = imagem_shape[:2]
+    
+    def normalizar(ponto):
+        return [round(ponto[0] / largura, 4), round(ponto[1] / altura, 4)]
+    
+    def pixel(indice):
+        return (landmarks[indice][0] * largura, landmarks[indice][1] * altura)
+    
+    p0, p5, p12, p17 = pixel(0), pixel(5), pixel(12), pixel(17)
+    inicio_pulso, fim_pulso = calcular_linha_pulso(p0, p12, dimensoes['distancia_base_px'] * MULTIPLICADOR_PULSO)
+    
+    contorno = None
+    if contorno_quadrado is not None:
+        perimetro = cv.arcLength(contorno_quadrado, True)
+        simplificado = cv.approxPolyDP(contorno_quadrado, 0.01 * perimetro, True)
+        contorno = [normalizar(ponto[0]) for ponto in simplificado]
+    
+    return {
+        "largura": largura,
+        "altura": altura,
+        "escala_px_cm": dimensoes['escala_px_cm'],
+        "tamanho_ortese": dimensoes['Tamanho Ortese'],
+        "landmarks": [[round(lm[0], 4), round(lm[1], 4)] for lm in landmarks],
+        "contorno_quadrado": contorno,
+        "segmentos": [
+            {"nome": "palma", "rotulo": "Palma", "valor_cm": dimensoes['Largura Palma'],
+             "de": normalizar(p5), "ate": normalizar(p17), "cor": "#0000ff"},
+            {"nome": "comprimento", "rotulo": "Comp", "valor_cm": dimensoes['Comprimento Mao'],
+             "de": normalizar(p0), "ate": normalizar(p12), "cor": "#00ff00"},
+            {"nome": "pulso", "rotulo": "Pulso", "valor_cm": dimensoes['Largura Pulso'],
+             "de": normalizar(inicio_pulso), "ate": normalizar(fim_pulso), "cor": "#ffa500"},
+        ]
+    }
+
+def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrado=None, max_dim=MAX_DIM_PREVIEW,
+                                  shape_original=None, rotulo=None, y_offset=30):
+    # Desenhar direto sobre o preview reduzido em vez de copiar a imagem inteira
+    if shape_original is not None:
+        # A imagem já é um preview; contorno e distâncias referem-se à original
+        fator = imagem.shape[1] / shape_original[1]
+        img_com_medidas = imagem.copy()
+    else:
+        img_com_medidas, fator = reduzir_para_preview(imagem, max_dim)
+    altura, largura = img_com_medidas.shape[:2]
     
     if contorno_quadrado is not None:
-        cv.drawContours(img_com_medidas, [contorno_quadrado], 0, (0, 0, 0), 3)  # Preto
+        contorno_preview = np.round(contorno_quadrado * fator).astype(np.int32)
+        cv.drawContours(img_com_medidas, [contorno_preview], 0, (0, 0, 0), 3)  # Preto
     
     # Converter landmarks para pixels
     p5 = (int(landmarks[5][0] * largura), int(landmarks[5][1] * altura))
@@ -173,7 +459,11 @@ def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrad
     p12 = (int(landmarks[12][0] * largura), int(landmarks[12][1] * altura))
     
     # Calcular pontos para as linhas usando os multiplicadores
-    distancia_base_px = dimensoes.get('distancia_base_px', math.hypot(p17[0]-p5[0], p17[1]-p5[1]))
+    # distancia_base_px vem em pixels da imagem original
+    if 'distancia_base_px' in dimensoes:
+        distancia_base_px = dimensoes['distancia_base_px'] * fator
+    else:
+        distancia_base_px = math.hypot(p17[0]-p5[0], p17[1]-p5[1])
     
     # LINHA DA PALMA (pontos 5-17)
     cv.line(img_com_medidas, p5, p17, (255, 0, 0), 3)
@@ -187,29 +477,10 @@ def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrad
               ((p0[0] + p12[0]) // 2 + 10, (p0[1] + p12[1]) // 2),
               cv.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     
-    # Calcular vetor do comprimento (0->12)
-    vetor_comprimento = (p12[0] - p0[0], p12[1] - p0[1])
-    
-    # Calcular vetor perpendicular (90 graus)
-    vetor_perpendicular = (-vetor_comprimento[1], vetor_comprimento[0])
-    
-    # Normalizar o vetor perpendicular
-    norma = math.hypot(vetor_perpendicular[0], vetor_perpendicular[1])
-    if norma > 0:
-        vetor_perpendicular = (vetor_perpendicular[0]/norma, vetor_perpendicular[1]/norma)
-    
-    # Calcular pontos da linha do pulso (centrada no ponto 0)
-    largura_pulso_px = distancia_base_px * MULTIPLICADOR_PULSO
-    metade_largura = largura_pulso_px / 2
-    
-    ponto_pulso_inicio = (
-        int(p0[0] - vetor_perpendicular[0] * metade_largura),
-        int(p0[1] - vetor_perpendicular[1] * metade_largura)
-    )
-    ponto_pulso_fim = (
-        int(p0[0] + vetor_perpendicular[0] * metade_largura),
-        int(p0[1] + vetor_perpendicular[1] * metade_largura)
-    )
+    # Linha do pulso perpendicular ao comprimento, centrada no ponto 0
+    inicio, fim = calcular_linha_pulso(p0, p12, distancia_base_px * MULTIPLICADOR_PULSO)
+    ponto_pulso_inicio = (int(inicio[0]), int(inicio[1]))
+    ponto_pulso_fim = (int(fim[0]), int(fim[1]))
     
     cv.line(img_com_medidas, ponto_pulso_inicio, ponto_pulso_fim, (0, 165, 255), 3)
     cv.putText(img_com_medidas, f"Pulso: {dimensoes['Largura Pulso']:.2f}cm",
@@ -227,9 +498,9 @@ def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrad
         cv.putText(img_com_medidas, str(i), (x-5, y-5), 
                   cv.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
     
-    # Informações adicionais
-    y_offset = 30
-    cv.putText(img_com_medidas, f"Tamanho: {dimensoes['Tamanho Ortese']}", 
+    # Informações adicionais (rotulo identifica a mão no modo bilateral)
+    titulo_tamanho = f"Tamanho ({rotulo})" if rotulo else "Tamanho"
+    cv.putText(img_com_medidas, f"{titulo_tamanho}: {dimensoes['Tamanho Ortese']}", 
                (10, y_offset), cv.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
     cv.putText(img_com_medidas, f"Escala: {dimensoes['escala_px_cm']:.2f} px/cm", 
                (10, y_offset + 30), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
@@ -238,46 +509,241 @@ def desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrad
     
     return img_com_medidas
 
-def gerar_stl_simplificado(dimensoes, handedness, output_path, modelo_base_path):
+def validar_modelo(entrada, diretorio):
+    """Valida uma entrada do manifesto e carrega sua malha; retorna (modelo, erro)."""
+    arquivo = entrada.get('arquivo')
+    if not arquivo:
+        return None, "entrada sem 'arquivo'"
+    tamanho = entrada.get('tamanho')
+    if tamanho not in TAMANHOS_ORTESE:
+        return None, f"{arquivo}: tamanho inválido {tamanho!r} (use {', '.join(TAMANHOS_ORTESE)})"
+    lado = entrada.get('lado')
+    if lado not in (None, 'Right', 'Left'):
+        return None, f"{arquivo}: lado inválido {lado!r} (use Right, Left ou null)"
     try:
-        print(f"Procurando modelo base em: {modelo_base_path}")
-        
-        if not os.path.exists(modelo_base_path):
+        perimetro_cm = float(entrada.get('perimetro_cm', 0))
+    except (TypeError, ValueError):
+        perimetro_cm = 0
+    if not perimetro_cm > 0:
+        return None, f"{arquivo}: perimetro_cm deve ser positivo"
+
+    caminho = os.path.join(diretorio, arquivo)
+    if not os.path.exists(caminho):
+        return None, f"{arquivo}: arquivo não encontrado"
+    vetores = mesh.Mesh.from_file(caminho).vectors
+    if len(vetores) == 0 or not np.isfinite(vetores).all():
+        return None, f"{arquivo}: malha vazia ou com coordenadas inválidas"
+
+    # Somente leitura: a malha é compartilhada por todas as requisições
+    # (e, com fork/gunicorn --preload, entre os workers; no asgi.py cada
+    # worker do pool spawn tem a sua cópia)
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    vetores.setflags(write=False)
+    return {'arquivo': arquivo, 'tamanho': tamanho, 'lado': lado,
+            'perimetro_cm': perimetro_cm, 'vetores': vetores}, None
+
+def carregar_biblioteca_modelos(diretorio=MODELOS_DIR, modelo_base_path=None):
+    """Carrega e valida uma única vez todos os modelos descritos no manifesto.
+
+    Formato de <diretorio>/manifesto.json:
+      {"modelos": [{"arquivo": "ortese_M.stl", "tamanho": "M",
+                    "lado": "Right" | "Left" | null, "perimetro_cm": 17.0}, ...]}
+    `perimetro_cm` é o perímetro de pulso para o qual o modelo foi desenhado.
+    `lado: null` é um modelo de mão direita, espelhado para a esquerda.
+    Sem manifesto, o modelo base único vira uma biblioteca de um modelo só
+    (perímetro PERIMETRO_MODELO_BASE_CM, todos os tamanhos). Com manifesto,
+    qualquer entrada inválida ou tamanho (P/M/G) sem modelo levanta ValueError:
+    melhor não subir do que escalar silenciosamente um modelo de outro tamanho.
+    Retorna a lista de modelos.
+    """
+    global _biblioteca_modelos
+    modelos = []
+    caminho_manifesto = os.path.join(diretorio, 'manifesto.json') if diretorio else None
+
+    if caminho_manifesto and os.path.exists(caminho_manifesto):
+        try:
+            with open(caminho_manifesto, encoding='utf-8') as f:
+                entradas = json.load(f).get('modelos', [])
+        except (OSError, ValueError, AttributeError) as e:
+            raise ValueError(f"Manifesto de modelos inválido ({caminho_manifesto}): {e}")
+
+        erros = []
+        for entrada in entradas:
+            try:
+                modelo, erro = validar_modelo(entrada, diretorio)
+            except Exception as e:
+                modelo, erro = None, f"{entrada.get('arquivo')}: {e}"
+            if erro:
+                erros.append(erro)
+                continue
+            modelos.append(modelo)
+            print(f"Modelo {modelo['arquivo']} ({modelo['tamanho']}, {modelo['lado'] or 'direita, espelhado para a esquerda'}, "
+                  f"{modelo['perimetro_cm']:.1f} cm): {len(modelo['vetores'])} triângulos")
+
+        faltando = [tamanho for tamanho in TAMANHOS_ORTESE
+                    if not any(modelo['tamanho'] == tamanho for modelo in modelos)]
+        if faltando:
+            erros.append(f"nenhum modelo válido para o(s) tamanho(s) {', '.join(faltando)}")
+        if erros:
+            raise ValueError(f"Manifesto de modelos inválido ({caminho_manifesto}): " + '; '.join(erros))
+
+    if not modelos and modelo_base_path:
+        if os.path.exists(modelo_base_path):
+            print(f"Carregando modelo STL: {modelo_base_path}")
+            vetores = np.ascontiguousarray(mesh.Mesh.from_file(modelo_base_path).vectors, dtype=np.float32)
+            vetores.setflags(write=False)
+            modelos.append({'arquivo': os.path.basename(modelo_base_path), 'tamanho': None, 'lado': None,
+                            'perimetro_cm': PERIMETRO_MODELO_BASE_CM, 'vetores': vetores})
+        else:
             print(f"Modelo base não encontrado em: {modelo_base_path}")
-            return False
+
+    print(f"Biblioteca de modelos: {len(modelos)} modelo(s) carregado(s)")
+    _biblioteca_modelos = modelos
+    return modelos
+
+def obter_biblioteca_modelos(modelo_base_path=None):
+    """Biblioteca já carregada; carrega na primeira chamada (ex.: uso fora do app).
+
+    Enquanto estiver vazia (nenhum manifesto nem modelo base), tenta de novo a
+    cada chamada, como antes: um modelo base adicionado depois passa a valer
+    sem reiniciar o servidor.
+    """
+    if not _biblioteca_modelos:
+        carregar_biblioteca_modelos(MODELOS_DIR, modelo_base_path)
+    return _biblioteca_modelos
+
+def selecionar_modelo(biblioteca, tamanho, handedness, perimetro_paciente):
+    """Escolhe o modelo mais próximo do paciente.
+
+    Prioridade: mesmo tamanho (P/M/G), menor escala residual (razão de
+    perímetros mais próxima de 1) e, por fim, modelo do mesmo lado (sem espelhar).
+    """
+    def distancia(modelo):
+        return (
+            modelo['tamanho'] is not None and modelo['tamanho'] != tamanho,
+            abs(math.log(perimetro_paciente / modelo['perimetro_cm'])),
+            modelo['lado'] is not None and modelo['lado'] != handedness,
+        )
+    return min(biblioteca, key=distancia) if biblioteca else None
+
+def caminho_3mf(stl_path):
+    return os.path.splitext(stl_path)[0] + '.3mf'
+
+def exportar_3mf(vetores, output_path):
+    """Grava a malha como 3MF: vértices compartilhados e triângulos indexados.
+
+    Mesma geometria do STL, sem as normais e os vértices repetidos.
+    """
+    try:
+        vertices, indices = np.unique(vetores.reshape(-1, 3), axis=0, return_inverse=True)
+        triangulos = indices.reshape(-1, 3)
         
-        print(f"Modelo base encontrado no caminho original")
+        # Descartar triângulos degenerados (vértices repetidos após a deduplicação)
+        validos = (triangulos[:, 0] != triangulos[:, 1]) & (triangulos[:, 1] != triangulos[:, 2]) \
+            & (triangulos[:, 0] != triangulos[:, 2])
+        triangulos = triangulos[validos]
         
-        # Carregar modelo base
-        print(f"Carregando modelo STL: {modelo_base_path}")
-        ortese_base = mesh.Mesh.from_file(modelo_base_path)
-        print(f"Modelo carregado: {len(ortese_base.vectors)} triângulos")
+        xml_vertices = ''.join(f'<vertex x="{x:.4f}" y="{y:.4f}" z="{z:.4f}"/>' for x, y, z in vertices)
+        xml_triangulos = ''.join(f'<triangle v1="{a}" v2="{b}" v3="{c}"/>' for a, b, c in triangulos)
+        modelo = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<model unit="millimeter" xml:lang="en-US" '
+            'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+            '<resources><object id="1" type="model"><mesh>'
+            f'<vertices>{xml_vertices}</vertices><triangles>{xml_triangulos}</triangles>'
+            '</mesh></object></resources>'
+            '<build><item objectid="1"/></build></model>'
+        )
+        content_types = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+            '</Types>'
+        )
+        relacoes = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+            'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+            '</Relationships>'
+        )
+        
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+            arquivo.writestr('[Content_Types].xml', content_types)
+            arquivo.writestr('_rels/.rels', relacoes)
+            arquivo.writestr('3D/3dmodel.model', modelo)
+        
+        print(f"3MF salvo: {output_path} ({len(vertices)} vértices, {len(triangulos)} triângulos, "
+              f"{os.path.getsize(output_path)} bytes)")
+        return True
         
+    except Exception as e:
+        print(f"Erro gerando 3MF: {e}")
+        return False
+
+def obter_3mf(stl_path):
+    """Caminho do 3MF equivalente ao STL, gerando-o só se não existir ou estiver velho.
+
+    Chamado no download, fora do caminho da requisição de processamento.
+    """
+    if not os.path.exists(stl_path):
+        return None
+    destino = caminho_3mf(stl_path)
+    if os.path.exists(destino) and os.path.getmtime(destino) >= os.path.getmtime(stl_path):
+        return destino
+
+    # Escrita atômica: downloads simultâneos nunca veem um arquivo pela metade
+    temporario = f"{destino}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        if not exportar_3mf(mesh.Mesh.from_file(stl_path).vectors, temporario):
+            return None
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return destino
+
+def gerar_stl_simplificado(dimensoes, handedness, output_path, modelo_base_path):
+    try:
         # Obter largura do pulso
         largura_pulso_cm = dimensoes.get("Largura Pulso", 0.0)
         if largura_pulso_cm == 0.0:
             print("Largura do pulso não encontrada nas dimensões")
             return False
-        
-        # Calcular fator de escala baseado no perímetro
+
         perimetro_paciente = 2.2 * largura_pulso_cm
-        perimetro_template = 10.0
+
+        # Modelo mais próximo da biblioteca já carregada
+        modelo = selecionar_modelo(obter_biblioteca_modelos(modelo_base_path),
+                                   dimensoes.get("Tamanho Ortese"), handedness, perimetro_paciente)
+        if modelo is None:
+            print("Nenhum modelo de órtese disponível")
+            return False
+        vetores_base = modelo['vetores']
+        perimetro_template = modelo['perimetro_cm']
+        lado_modelo = modelo['lado']
+        print(f"   Modelo: {modelo['arquivo']}")
+
+        # Escalar só o residual entre o paciente e o modelo escolhido
         fator_escala = perimetro_paciente / perimetro_template
-        
+
         print(f"   Escalonamento STL:")
         print(f"   Pulso: {largura_pulso_cm:.2f}cm")
         print(f"   Perímetro: {perimetro_paciente:.2f}cm")
         print(f"   Fator: {fator_escala:.3f}")
-        
+
         # CORREÇÃO SIMPLES: Escalonar os vetores diretamente
-        ortese_escalada = mesh.Mesh(np.zeros(ortese_base.vectors.shape[0], dtype=mesh.Mesh.dtype))
-        ortese_escalada.vectors = ortese_base.vectors * fator_escala
-        
-        # Espelhar para mão esquerda (se necessário)
-        if handedness == "Left":
-            print("Espelhando para mão esquerda")
+        ortese_escalada = mesh.Mesh(np.zeros(vetores_base.shape[0], dtype=mesh.Mesh.dtype))
+        ortese_escalada.vectors = vetores_base * fator_escala
+
+        # Espelhar quando o modelo é do outro lado (lado null = direita, espelhado para a esquerda)
+        if handedness != (lado_modelo or "Right"):
+            print(f"Espelhando para mão {'esquerda' if handedness == 'Left' else 'direita'}")
             # Inverter o eixo X para espelhar
             ortese_escalada.vectors[:,:,0] *= -1.0
+            # O espelhamento inverte a orientação das faces; restaurar a ordem dos vértices
+            ortese_escalada.vectors = ortese_escalada.vectors[:, ::-1, :].copy()
         
         # Garantir que o diretório de saída existe
         os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
@@ -319,12 +785,16 @@ def gerar_stl_simplificado(dimensoes, handedness, output_path, modelo_base_path)
         traceback.print_exc()
         return False
 
-def pipeline_processamento_simplificado(caminho_imagem, caminho_stl_saida=None, modo_manual=False, modelo_base_path=None):
+def pipeline_processamento_simplificado(caminho_imagem, caminho_stl_saida=None, modo_manual=False, modelo_base_path=None,
+                                        estado=None, desenhar=True):
     try:
         print("Iniciando pipeline simplificado...")
         
-        # Carregar imagem
-        imagem = cv.imread(caminho_imagem)
+        # Carregar imagem (aceita caminho ou imagem já decodificada)
+        if isinstance(caminho_imagem, np.ndarray):
+            imagem = caminho_imagem
+        else:
+            imagem = cv.imread(caminho_imagem)
         if imagem is None:
             print("Não foi possível carregar a imagem")
             return None, None, None, None, None
@@ -345,28 +815,36 @@ def pipeline_processamento_simplificado(caminho_imagem, caminho_stl_saida=None,
         
         # 2. Detectar landmarks
         print("Detectando landmarks...")
-        with mp_hands.Hands(static_image_mode=True, max_num_hands=1, min_detection_confidence=0.5) as hands:
-            imagem_rgb = cv.cvtColor(imagem, cv.COLOR_BGR2RGB)
-            resultados = hands.process(imagem_rgb)
-            
-            if not resultados.multi_hand_landmarks:
-                print("Nenhuma mão detectada")
-                return None, None, None, None, None
-            
-            hand_landmarks = resultados.multi_hand_landmarks[0]
-            landmarks = [(lm.x, lm.y, lm.z) for lm in hand_landmarks.landmark]
-            
-            handedness_detectado = "Right"
-            if resultados.multi_handedness:
-                for classification in resultados.multi_handedness[0].classification:
-                    handedness_detectado = classification.label
-                    break
-            
-            print(f"{len(landmarks)} landmarks detectados - Mão detectada: {handedness_detectado}")
-            
-            # CORREÇÃO: Aplicar correção da detecção da mão
-            handedness = corrigir_detecao_mao(landmarks, handedness_detectado, imagem.shape)
-            print(f"Mão final: {handedness}")
+        resultados = detectar_landmarks(imagem)
+        
+        if not resultados.multi_hand_landmarks:
+            print("Nenhuma mão detectada")
+            return None, None, None, None, None
+        
+        hand_landmarks = resultados.multi_hand_landmarks[0]
+        landmarks = [(lm.x, lm.y, lm.z) for lm in hand_landmarks.landmark]
+        
+        handedness_detectado = "Right"
+        if resultados.multi_handedness:
+            for classification in resultados.multi_handedness[0].classification:
+                handedness_detectado = classification.label
+                break
+        
+        print(f"{len(landmarks)} landmarks detectados - Mão detectada: {handedness_detectado}")
+        
+        # CORREÇÃO: Aplicar correção da detecção da mão
+        handedness = corrigir_detecao_mao(landmarks, handedness_detectado, imagem.shape)
+        print(f"Mão final: {handedness}")
+        
+        # Guardar o estado intermediário para correções manuais
+        if estado is not None:
+            estado.update({
+                'imagem': imagem,
+                'contorno_quadrado': contorno_quadrado,
+                'escala_px_cm': escala_px_cm,
+                'landmarks': landmarks,
+                'handedness_detectado': handedness_detectado,
+            })
         
         # 3. Calcular dimensões
         print("Calculando dimensões...")
@@ -379,9 +857,11 @@ def pipeline_processamento_simplificado(caminho_imagem, caminho_stl_saida=None,
         for key, value in dimensoes.items():
             print(f"   {key}: {value}")
         
-        # 4. Desenhar resultados
-        print("Desenhando medidas e landmarks...")
-        imagem_resultado = desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrado)
+        # 4. Desenhar resultados (dispensado quando o frontend desenha o overlay)
+        imagem_resultado = None
+        if desenhar:
+            print("Desenhando medidas e landmarks...")
+            imagem_resultado = desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrado)
         
         # 5. Gerar STL se solicitado
         stl_gerado = None
@@ -404,69 +884,395 @@ def pipeline_processamento_simplificado(caminho_imagem, caminho_stl_saida=None,
         traceback.print_exc()
         return None, None, None, None, None
 
-def processar_imagem_ortese_api(imagem_bytes, modo_manual=False, modelo_base_stl_path=None):
+def criar_sessao_correcao(imagem, contorno_quadrado, escala_px_cm, landmarks, handedness_detectado):
+    """Salva o estado de uma análise para correções posteriores. Retorna o id da sessão.
+
+    Fica em disco (SESSOES_DIR) para ser visível a todos os workers da máquina.
+    """
+    os.makedirs(SESSOES_DIR, exist_ok=True)
+    limpar_sessoes_expiradas()
+
+    sessao_id = uuid.uuid4().hex
+    base = os.path.join(SESSOES_DIR, sessao_id)
+    preview, _ = reduzir_para_preview(imagem)
+    contorno = contorno_quadrado if contorno_quadrado is not None else np.zeros((0, 1, 2), np.int32)
+    np.savez(base + '.npz', preview=preview, contorno=contorno)
+
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'shape': list(imagem.shape[:2]),
+            'escala_px_cm': escala_px_cm,
+            'landmarks': [list(lm) for lm in landmarks],
+            'handedness_detectado': handedness_detectado,
+        }, f)
+
+    return sessao_id
+
+def carregar_sessao_correcao(sessao_id):
+    """Retorna (meta, preview, contorno) ou None se a sessão não existir.
+
+    Cada uso renova a validade da sessão (mtime dos dois arquivos).
+    """
+    limpar_sessoes_expiradas()
+    if not sessao_id or not all(c in '0123456789abcdef' for c in sessao_id):
+        return None
+    base = os.path.join(SESSOES_DIR, sessao_id)
+    try:
+        ultimo_uso = max(os.path.getmtime(base + '.npz'), os.path.getmtime(base + '.json'))
+        if time.time() - ultimo_uso > SESSOES_TTL_S:
+            return None
+        for extensao in ('.npz', '.json'):
+            os.utime(base + extensao)
+    except OSError:
+        return None
+
+    with open(base + '.json', encoding='utf-8') as f:
+        meta = json.load(f)
+    with np.load(base + '.npz') as arrays:
+        preview = arrays['preview']
+        contorno = arrays['contorno'] if arrays['contorno'].size else None
+    return meta, preview, contorno
+
+def limpar_sessoes_expiradas(forcar=False):
+    """Remove juntos os arquivos (.npz e .json) das sessões sem uso há SESSOES_TTL_S.
+
+    A sessão expira pelo acesso mais recente entre seus arquivos; a varredura
+    roda no máximo a cada SESSOES_INTERVALO_LIMPEZA_S.
+    """
+    global _ultima_limpeza_sessoes
+    agora = time.time()
+    if not forcar and agora - _ultima_limpeza_sessoes < SESSOES_INTERVALO_LIMPEZA_S:
+        return
+    _ultima_limpeza_sessoes = agora
+    if not os.path.isdir(SESSOES_DIR):
+        return
+
+    ultimo_uso = {}
+    for nome in os.listdir(SESSOES_DIR):
+        sessao_id = nome.split('.', 1)[0]
+        try:
+            mtime = os.path.getmtime(os.path.join(SESSOES_DIR, nome))
+        except OSError:
+            continue
+        ultimo_uso[sessao_id] = max(ultimo_uso.get(sessao_id, 0.0), mtime)
+
+    for sessao_id, mtime in ultimo_uso.items():
+        if agora - mtime > SESSOES_TTL_S:
+            for extensao in ('.npz', '.json'):
+                try:
+                    os.remove(os.path.join(SESSOES_DIR, sessao_id + extensao))
+                except OSError:
+                    pass
+
+def aplicar_correcoes_landmarks(landmarks, landmarks_ajustados):
+    """Aplica coordenadas corrigidas (normalizadas 0-1) sobre os landmarks.
+
+    Aceita a lista completa de 21 pontos ou um dict {indice: [x, y]}.
+    """
+    if isinstance(landmarks_ajustados, list):
+        if len(landmarks_ajustados) != len(landmarks):
+            raise ValueError(f"Esperados {len(landmarks)} landmarks, recebidos {len(landmarks_ajustados)}")
+        landmarks_ajustados = dict(enumerate(landmarks_ajustados))
+
+    corrigidos = [list(lm) for lm in landmarks]
+    for indice, ponto in landmarks_ajustados.items():
+        indice = int(indice)
+        if not 0 <= indice < len(corrigidos):
+            raise ValueError(f"Índice de landmark inválido: {indice}")
+        x, y = float(ponto[0]), float(ponto[1])
+        if not (0.0 <= x <= 1.0 and 0.0 <= y <= 1.0):
+            raise ValueError(f"Coordenadas do landmark {indice} devem estar entre 0 e 1")
+        corrigidos[indice][0], corrigidos[indice][1] = x, y
+    return [tuple(lm) for lm in corrigidos]
+
+def montar_url_stl(stl_path):
+    if stl_path and os.path.exists(stl_path):
+        # CORREÇÃO: Usar o mesmo arquivo, não copiar
+        stl_filename = os.path.basename(stl_path)
+        stl_url = f"/api/download-stl/{stl_filename}"
+        
+        print(f"STL disponível para download: {stl_url}")
+        print(f"Caminho real do arquivo: {stl_path}")
+        print(f"Tamanho do arquivo: {os.path.getsize(stl_path)} bytes")
+        return stl_url
+
+    print("Nenhum STL gerado para download")
+    if stl_path:
+        print(f"❌ Arquivo STL não existe em: {stl_path}")
+    return None
+
+def montar_url_3mf(stl_path):
+    # O arquivo em si é gerado no primeiro download (obter_3mf)
+    if EXPORTAR_3MF and stl_path and os.path.exists(stl_path):
+        return f"/api/download-3mf/{os.path.basename(caminho_3mf(stl_path))}"
+    return None
+
+def caminho_stl_unico():
+    # (sufixo aleatório evita colisão entre requisições concorrentes no mesmo segundo)
+    return os.path.join(UPLOAD_FOLDER, f"ortese_gerada_{int(time.time())}_{uuid.uuid4().hex[:8]}.stl")
+
+def recalcular_medidas_api(sessao_id, landmarks_ajustados=None, escala_px_cm=None, modelo_base_stl_path=None,
+                           overlay_cliente=False):
+    """Refaz só dimensões, desenho e STL de uma sessão com landmarks/escala corrigidos."""
+    try:
+        inicio = time.perf_counter()
+        sessao = carregar_sessao_correcao(sessao_id)
+        if sessao is None:
+            return {"erro": "Sessão de correção não encontrada ou expirada"}
+        meta, preview, contorno_quadrado = sessao
+        
+        landmarks = [tuple(lm) for lm in meta['landmarks']]
+        if landmarks_ajustados:
+            landmarks = aplicar_correcoes_landmarks(landmarks, landmarks_ajustados)
+        if escala_px_cm is not None:
+            escala_px_cm = float(escala_px_cm)
+            if not (math.isfinite(escala_px_cm) and escala_px_cm > 0):
+                return {"erro": "Escala deve ser um número positivo"}
+            meta['escala_px_cm'] = escala_px_cm
+        meta['landmarks'] = [list(lm) for lm in landmarks]
+        
+        shape = tuple(meta['shape'])
+        handedness = corrigir_detecao_mao(landmarks, meta['handedness_detectado'], shape)
+        dimensoes = calcular_dimensoes_simplificado(landmarks, meta['escala_px_cm'], shape)
+        if dimensoes is None:
+            return {"erro": "Erro no cálculo das dimensões"}
+        
+        overlay = None
+        imagem_base64 = None
+        if overlay_cliente:
+            overlay = montar_overlay(landmarks, dimensoes, contorno_quadrado, shape)
+        else:
+            imagem_processada = desenhar_medidas_simplificado(preview, landmarks, dimensoes, contorno_quadrado,
+                                                              shape_original=shape)
+            imagem_base64 = imagem_para_base64(imagem_processada)
+        
+        stl_path = None
+        if modelo_base_stl_path:
+            stl_path = caminho_stl_unico()
+            if not gerar_stl_simplificado(dimensoes, handedness, stl_path, modelo_base_stl_path):
+                stl_path = None
+        
+        # Correções seguintes partem dos valores já corrigidos
+        with open(os.path.join(SESSOES_DIR, sessao_id + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        
+        tempo_ms = (time.perf_counter() - inicio) * 1000
+        print(f"Medidas recalculadas para a sessão {sessao_id} em {tempo_ms:.1f} ms")
+        
+        return {
+            "sucesso": True,
+            "sessao_id": sessao_id,
+            "dimensoes": dimensoes,
+            "handedness": handedness,
+            "landmarks": meta['landmarks'],
+            "imagem_processada": imagem_base64,
+            "overlay": overlay,
+            "stl_url": montar_url_stl(stl_path),
+            "url_3mf": montar_url_3mf(stl_path),
+            "tempo_ms": round(tempo_ms, 1),
+            "tipo_processamento": "correcao_manual"
+        }
+        
+    except ValueError as e:
+        return {"erro": str(e)}
+    except Exception as e:
+        print(f"Erro recalculando medidas: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"erro": f"Erro recalculando medidas: {str(e)}"}
+
+def pipeline_processamento_bilateral(imagem, modelo_base_path=None, desenhar=True):
+    """Processa as duas mãos com uma única passada do MediaPipe.
+
+    A escala do quadrado azul é compartilhada; cada mão recebe suas medidas e
+    seu STL (espelhado conforme o lado), gerado a partir do modelo mais próximo
+    da biblioteca já carregada. Retorna (maos, imagem_resultado) ou (None, None).
+    """
+    try:
+        print("Iniciando pipeline bilateral...")
+        
+        # 1. Detectar quadrado azul (uma vez para as duas mãos)
+        contorno_quadrado, dimensoes_quadrado, _ = detectar_quadrado_azul(imagem)
+        escala_px_cm = 67.92  # Fallback
+        if contorno_quadrado is not None:
+            x, y, w, h = dimensoes_quadrado
+            escala_px_cm = (w + h) / (2 * TAMANHO_QUADRADO_CM)
+            print(f"Quadrado: {w}x{h} px, Escala: {escala_px_cm:.2f} px/cm")
+        else:
+            print("Quadrado não detectado, usando escala padrão")
+        
+        # 2. Detectar até duas mãos numa única inferência
+        resultados = detectar_landmarks(imagem, max_num_hands=2)
+        if not resultados.multi_hand_landmarks:
+            print("Nenhuma mão detectada")
+            return None, None
+        
+        deteccoes = []
+        for i, hand_landmarks in enumerate(resultados.multi_hand_landmarks):
+            landmarks = [(lm.x, lm.y, lm.z) for lm in hand_landmarks.landmark]
+            handedness_detectado = "Right"
+            if resultados.multi_handedness and i < len(resultados.multi_handedness):
+                handedness_detectado = resultados.multi_handedness[i].classification[0].label
+            handedness = corrigir_detecao_mao(landmarks, handedness_detectado, imagem.shape)
+            deteccoes.append((landmarks, handedness))
+        
+        # Ordem estável: da esquerda para a direita na imagem (pelo pulso)
+        deteccoes.sort(key=lambda deteccao: deteccao[0][0][0])
+        if len(deteccoes) == 2 and deteccoes[0][1] == deteccoes[1][1]:
+            print(f"Aviso: as duas mãos foram classificadas como '{deteccoes[0][1]}'")
+        print(f"{len(deteccoes)} mão(s) detectada(s)")
+        
+        maos = []
+        imagem_resultado = None
+        for i, (landmarks, handedness) in enumerate(deteccoes):
+            # 3. Dimensões por mão com a escala compartilhada
+            dimensoes = calcular_dimensoes_simplificado(landmarks, escala_px_cm, imagem.shape)
+            if dimensoes is None:
+                continue
+            
+            # 4. Desenhar todas as mãos no mesmo preview (ou só a geometria para o frontend)
+            rotulo = "Direita" if handedness == "Right" else "Esquerda"
+            overlay = None
+            if not desenhar:
+                overlay = montar_overlay(landmarks, dimensoes, contorno_quadrado, imagem.shape)
+            elif imagem_resultado is None:
+                imagem_resultado = desenhar_medidas_simplificado(imagem, landmarks, dimensoes, contorno_quadrado,
+                                                                 rotulo=rotulo)
+            else:
+                imagem_resultado = desenhar_medidas_simplificado(imagem_resultado, landmarks, dimensoes,
+                                                                 shape_original=imagem.shape, rotulo=rotulo,
+                                                                 y_offset=30 + 90 * i)
+            
+            # 5. STL de cada mão a partir da biblioteca de modelos
+            stl_gerado = None
+            if modelo_base_path:
+                caminho_stl = caminho_stl_unico()
+                if gerar_stl_simplificado(dimensoes, handedness, caminho_stl, modelo_base_path):
+                    stl_gerado = caminho_stl
+            
+            maos.append({'handedness': handedness, 'dimensoes': dimensoes, 'stl_path': stl_gerado,
+                         'overlay': overlay})
+        
+        if not maos:
+            return None, None
+        
+        print("Pipeline bilateral concluído!")
+        return maos, imagem_resultado
+        
+    except Exception as e:
+        print(f"Erro no pipeline bilateral: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, None
+
+def processar_bilateral_api(imagem, modelo_base_stl_path=None, overlay_cliente=False):
+    maos, imagem_processada = pipeline_processamento_bilateral(imagem, modelo_base_stl_path,
+                                                              desenhar=not overlay_cliente)
+    if not maos:
+        return {"erro": "Não foi possível processar a imagem"}
+    
+    imagem_base64 = None
+    if not overlay_cliente:
+        imagem_base64 = imagem_para_base64(imagem_processada)
+        if imagem_base64 is None:
+            return {"erro": "Erro ao processar imagem para exibição"}
+    
+    maos_resposta = [
+        {
+            "handedness": mao['handedness'],
+            "dimensoes": mao['dimensoes'],
+            "stl_url": montar_url_stl(mao['stl_path']),
+            "url_3mf": montar_url_3mf(mao['stl_path']),
+            "overlay": mao['overlay']
+        }
+        for mao in maos
+    ]
+    
+    # O MediaPipe às vezes classifica as duas mãos com o mesmo lado: o STL de
+    # uma delas sairia espelhado errado, então o cliente precisa ser avisado
+    aviso = None
+    if len(maos) == 2 and maos[0]['handedness'] == maos[1]['handedness']:
+        lado = "direita" if maos[0]['handedness'] == "Right" else "esquerda"
+        aviso = f"As duas mãos foram identificadas como {lado}; confira o lado de cada órtese antes de imprimir"
+    
+    # Campos de topo repetem a primeira mão para clientes de uma mão só
+    return {
+        "sucesso": True,
+        "dimensoes": maos_resposta[0]['dimensoes'],
+        "handedness": maos_resposta[0]['handedness'],
+        "stl_url": maos_resposta[0]['stl_url'],
+        "url_3mf": maos_resposta[0]['url_3mf'],
+        "maos": maos_resposta,
+        "overlay": maos_resposta[0]['overlay'],
+        "imagem_processada": imagem_base64,
+        "aviso": aviso,
+        "tipo_processamento": "bilateral"
+    }
+
+def processar_imagem_ortese_api(imagem_bytes, modo_manual=False, modelo_base_stl_path=None, modo_bilateral=False,
+                                overlay_cliente=False):
     try:
         print("Processando imagem para API...")
         
-        # Converter bytes para imagem
-        nparr = np.frombuffer(imagem_bytes, np.uint8)
-        imagem = cv.imdecode(nparr, cv.IMREAD_COLOR)
+        # Converter bytes para imagem (valida cabeçalho antes do decode)
+        imagem, erro = decodificar_imagem(imagem_bytes)
         
         if imagem is None:
-            return {"erro": "Não foi possível carregar a imagem"}
+            return {"erro": erro}
         
-        # Salvar temporariamente
-        temp_img_path = os.path.join(UPLOAD_FOLDER, f"temp_processamento_{int(time.time())}.jpg")
-        cv.imwrite(temp_img_path, imagem)
+        if modo_bilateral:
+            return processar_bilateral_api(imagem, modelo_base_stl_path, overlay_cliente)
         
         # Gerar nome único para o STL
-        temp_stl_path = os.path.join(UPLOAD_FOLDER, f"ortese_gerada_{int(time.time())}.stl")
+        temp_stl_path = caminho_stl_unico()
         
-        print(f"Processando imagem: {temp_img_path}")
+        print(f"Processando imagem: {imagem.shape}")
         print(f"Saída STL: {temp_stl_path}")
         print(f"Modelo base: {modelo_base_stl_path}")
         
-        # Processar
+        # Processar direto da imagem decodificada (sem regravar em disco)
+        # O estado intermediário alimenta as correções manuais e o overlay do frontend
+        estado = {} if modo_manual or overlay_cliente else None
         stl_path, imagem_processada, _, dimensoes, handedness = pipeline_processamento_simplificado(
-            temp_img_path, temp_stl_path, modo_manual, modelo_base_stl_path
+            imagem, temp_stl_path, modo_manual, modelo_base_stl_path, estado, desenhar=not overlay_cliente
         )
         
-        # Limpar arquivo temporário da imagem
-        if os.path.exists(temp_img_path):
-            os.remove(temp_img_path)
-        
         if dimensoes is None:
             return {"erro": "Não foi possível processar a imagem"}
         
-        # Converter imagem para base64
-        imagem_base64 = imagem_para_base64(imagem_processada)
-        if imagem_base64 is None:
-            return {"erro": "Erro ao processar imagem para exibição"}
+        # Converter imagem para base64 (o preview já vem reduzido)
+        imagem_base64 = None
+        if not overlay_cliente:
+            imagem_base64 = imagem_para_base64(imagem_processada)
+            if imagem_base64 is None:
+                return {"erro": "Erro ao processar imagem para exibição"}
         
         # Preparar URL para download do STL
-        stl_url = None
-        if stl_path and os.path.exists(stl_path):
-            # CORREÇÃO: Usar o mesmo arquivo, não copiar
-            stl_filename = os.path.basename(stl_path)
-            stl_url = f"/backend/models/{stl_filename}"
-            
-            print(f"STL disponível para download: {stl_url}")
-            print(f"Caminho real do arquivo: {stl_path}")
-            print(f"Tamanho do arquivo: {os.path.getsize(stl_path)} bytes")
-        else:
-            print("Nenhum STL gerado para download")
-            if stl_path:
-                print(f"❌ Arquivo STL não existe em: {stl_path}")
+        stl_url = montar_url_stl(stl_path)
         
-        return {
+        resposta = {
             "sucesso": True,
             "dimensoes": dimensoes,
             "handedness": handedness,
             "imagem_processada": imagem_base64,
             "stl_url": stl_url,
+            "url_3mf": montar_url_3mf(stl_path),
             "tipo_processamento": "simplificado"
         }
         
+        if overlay_cliente:
+            resposta["overlay"] = montar_overlay(estado['landmarks'], dimensoes, estado['contorno_quadrado'],
+                                                 imagem.shape)
+        
+        if modo_manual and estado:
+            resposta["sessao_id"] = criar_sessao_correcao(
+                estado['imagem'], estado['contorno_quadrado'], estado['escala_px_cm'],
+                estado['landmarks'], estado['handedness_detectado']
+            )
+            resposta["landmarks"] = [list(lm) for lm in estado['landmarks']]
+        
+        return resposta
+        
     except Exception as e:
         print(f"Erro no processamento: {e}")
         import traceback
@@ -0,0 +1,224 @@
+# processar_lote.py - Processamento offline de pastas de fotos em todos os núcleos
+#
+# Percorre uma pasta (ou um manifesto .txt com um caminho por linha), roda o
+# pipeline em um pool de processos com o detector MediaPipe pré-carregado em
+# cada worker e grava um CSV com dimensões, mão e tempos. Opcionalmente gera
+# os STLs e converte o resultado para Parquet.
+#
+# O CSV é gravado linha a linha: se a execução for interrompida, basta rodar
+# o mesmo comando de novo e as imagens já registradas são puladas (com
+# --repetir-erros, as que falharam são processadas de novo).
+#
+# Uso (a partir da pasta backend/):
+#   python processar_lote.py fotos/ --saida medidas.csv --stl-dir stls/
+#   python processar_lote.py lista.txt --multiplicador-pulso 0.92 --parquet medidas.parquet
+import os
+import sys
+import csv
+import time
+import hashlib
+import argparse
+import contextlib
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import processamento_api as processamento
+
+EXTENSOES_PADRAO = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+MODELO_BASE_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'modelo_base.stl')
+
+COLUNAS = [
+    'arquivo', 'status', 'erro', 'handedness',
+    'Largura Pulso', 'Largura Palma', 'Comprimento Mao', 'Tamanho Ortese', 'escala_px_cm',
+    'stl', 'tempo_decodificar_ms', 'tempo_pipeline_ms', 'tempo_total_ms',
+]
+
+# Configuração de cada worker (definida em inicializar_worker)
+_config_worker = {}
+
+
+def listar_imagens(entrada, extensoes):
+    """Lista as imagens de uma pasta (recursivamente) ou de um manifesto."""
+    if os.path.isdir(entrada):
+        caminhos = []
+        for raiz, _, arquivos in os.walk(entrada):
+            for nome in arquivos:
+                if nome.lower().endswith(extensoes):
+                    caminhos.append(os.path.join(raiz, nome))
+        return sorted(caminhos)
+
+    base = os.path.dirname(os.path.abspath(entrada))
+    with open(entrada, encoding='utf-8') as f:
+        linhas = [linha.strip() for linha in f if linha.strip() and not linha.startswith('#')]
+    return [linha if os.path.isabs(linha) else os.path.join(base, linha) for linha in linhas]
+
+
+def ler_processados(caminho_csv, repetir_erros=False):
+    """Imagens já registradas no CSV de saída (para retomar a execução).
+
+    Com repetir_erros, as linhas com erro são removidas do CSV para que
+    essas imagens sejam processadas (e registradas) de novo.
+    """
+    if not os.path.exists(caminho_csv):
+        return set()
+    with open(caminho_csv, newline='', encoding='utf-8') as f:
+        linhas = list(csv.DictReader(f))
+
+    if repetir_erros:
+        linhas = [linha for linha in linhas if linha['status'] == 'ok']
+        temporario = caminho_csv + '.tmp'
+        with open(temporario, 'w', newline='', encoding='utf-8') as f:
+            escritor = csv.DictWriter(f, fieldnames=COLUNAS)
+            escritor.writeheader()
+            escritor.writerows(linhas)
+        os.replace(temporario, caminho_csv)
+
+    return {linha['arquivo'] for linha in linhas}
+
+
+def nome_stl(caminho):
+    """Nome do STL de uma imagem; o hash do caminho evita colisões entre
+    a/foto1.jpg, b/foto1.jpg e foto1.png."""
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    sufixo = hashlib.sha1(os.path.abspath(caminho).encode('utf-8')).hexdigest()[:8]
+    return f'{nome}_{sufixo}.stl'
+
+
+def inicializar_worker(config):
+    """Aplica os multiplicadores e pré-carrega o detector e os modelos no worker."""
+    _config_worker.update(config)
+    if config.get('multiplicador_pulso') is not None:
+        processamento.MULTIPLICADOR_PULSO = config['multiplicador_pulso']
+    if config.get('multiplicador_palma') is not None:
+        processamento.MULTIPLICADOR_PALMA = config['multiplicador_palma']
+    if config.get('stl_dir'):
+        # Já carregada no processo pai quando os workers são criados por fork
+        processamento.obter_biblioteca_modelos(config['modelo'])
+    processamento.obter_detector_maos()
+
+
+def processar_arquivo(caminho):
+    linha = {'arquivo': caminho, 'status': 'erro'}
+    inicio = time.perf_counter()
+
+    try:
+        with open(caminho, 'rb') as f:
+            imagem_bytes = f.read()
+
+        imagem, erro = processamento.decodificar_imagem(imagem_bytes)
+        linha['tempo_decodificar_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        if imagem is None:
+            linha['erro'] = erro
+            return linha
+
+        caminho_stl = None
+        if _config_worker.get('stl_dir'):
+            caminho_stl = os.path.join(_config_worker['stl_dir'], nome_stl(caminho))
+
+        inicio_pipeline = time.perf_counter()
+        with contextlib.ExitStack() as pilha:
+            # O pipeline é verboso; silenciar o log por imagem, salvo com --verboso
+            if not _config_worker.get('verboso'):
+                pilha.enter_context(contextlib.redirect_stdout(pilha.enter_context(open(os.devnull, 'w'))))
+            stl_gerado, _, _, dimensoes, handedness = processamento.pipeline_processamento_simplificado(
+                imagem, caminho_stl, False, _config_worker.get('modelo') if caminho_stl else None
+            )
+        linha['tempo_pipeline_ms'] = round((time.perf_counter() - inicio_pipeline) * 1000, 1)
+
+        if dimensoes is None:
+            linha['erro'] = 'Não foi possível processar a imagem'
+            return linha
+
+        linha.update({chave: dimensoes.get(chave) for chave in
+                      ('Largura Pulso', 'Largura Palma', 'Comprimento Mao', 'Tamanho Ortese', 'escala_px_cm')})
+        linha['handedness'] = handedness
+        linha['stl'] = stl_gerado
+        linha['status'] = 'ok'
+
+    except Exception as e:
+        linha['erro'] = str(e)
+
+    finally:
+        linha['tempo_total_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+
+    return linha
+
+
+def converter_para_parquet(caminho_csv, caminho_parquet):
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas/pyarrow não instalados; Parquet não gerado")
+        return False
+    pd.read_csv(caminho_csv).to_parquet(caminho_parquet, index=False)
+    print(f"Parquet salvo em {caminho_parquet}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Processa lotes de fotos de mãos e grava as medidas')
+    parser.add_argument('entrada', help='Pasta de imagens ou manifesto .txt (um caminho por linha)')
+    parser.add_argument('--saida', default='medidas.csv', help='CSV de resultados (também usado para retomar)')
+    parser.add_argument('--parquet', help='Também gravar o resultado em Parquet (requer pandas + pyarrow)')
+    parser.add_argument('--stl-dir', help='Gerar um STL por imagem nesta pasta')
+    parser.add_argument('--modelo', default=MODELO_BASE_PADRAO, help='Modelo base STL (usado sem manifesto em MODELOS_DIR)')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--multiplicador-pulso', type=float, help=f'Padrão: {processamento.MULTIPLICADOR_PULSO}')
+    parser.add_argument('--multiplicador-palma', type=float, help=f'Padrão: {processamento.MULTIPLICADOR_PALMA}')
+    parser.add_argument('--recomecar', action='store_true', help='Ignorar o CSV existente e processar tudo')
+    parser.add_argument('--repetir-erros', action='store_true', help='Processar de novo as imagens que falharam')
+    parser.add_argument('--verboso', action='store_true', help='Mostrar o log do pipeline')
+    args = parser.parse_args()
+
+    imagens = listar_imagens(args.entrada, EXTENSOES_PADRAO)
+    if args.recomecar and os.path.exists(args.saida):
+        os.remove(args.saida)
+    processados = ler_processados(args.saida, args.repetir_erros)
+    pendentes = [caminho for caminho in imagens if caminho not in processados]
+    print(f"{len(imagens)} imagens, {len(processados)} já processadas, {len(pendentes)} pendentes")
+
+    if args.stl_dir:
+        try:
+            modelos = processamento.carregar_biblioteca_modelos(processamento.MODELOS_DIR, args.modelo)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if not modelos:
+            print(f"Nenhum modelo em {processamento.MODELOS_DIR} nem em: {args.modelo}")
+            sys.exit(1)
+        os.makedirs(args.stl_dir, exist_ok=True)
+
+    config = {
+        'stl_dir': args.stl_dir,
+        'modelo': args.modelo,
+        'multiplicador_pulso': args.multiplicador_pulso,
+        'multiplicador_palma': args.multiplicador_palma,
+        'verboso': args.verboso,
+    }
+
+    novo_arquivo = not os.path.exists(args.saida)
+    inicio = time.perf_counter()
+    ok = 0
+    with open(args.saida, 'a', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUNAS)
+        if novo_arquivo:
+            escritor.writeheader()
+
+        if pendentes:
+            with multiprocessing.Pool(args.processos, initializer=inicializar_worker, initargs=(config,)) as pool:
+                for i, linha in enumerate(pool.imap_unordered(processar_arquivo, pendentes), start=1):
+                    escritor.writerow(linha)
+                    f.flush()
+                    ok += linha['status'] == 'ok'
+                    print(f"[{i}/{len(pendentes)}] {linha['status']:4} {linha['arquivo']} "
+                          f"({linha.get('tempo_total_ms', 0):.0f} ms)")
+
+    duracao = time.perf_counter() - inicio
+    print(f"Concluído: {ok}/{len(pendentes)} com sucesso em {duracao:.1f} s")
+
+    if args.parquet:
+        converter_para_parquet(args.saida, args.parquet)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,11 @@ const API_BASE = IS_PRODUCTION
 
 console.log('Configuração carregada:', { ambiente: IS_PRODUCTION ? 'PRODUÇÃO' : 'DESENVOLVIMENTO', api: API_BASE });
 
+// Converte caminhos '/api/...' devolvidos pelo backend em URLs absolutas da API
+function urlApi(caminho) {
+    return `${API_BASE}${caminho.replace(/^\/api/, '')}`;
+}
+
 let pacienteAtual = null;
 let dadosPaciente = {};
 
@@ -163,6 +168,8 @@ async function cadastrarPaciente() {
 async function processarImagem() {
     const arquivoInput = document.getElementById('imagem');
     const modoManual = document.getElementById('modo-manual').checked;
+    const modoBilateralInput = document.getElementById('modo-bilateral');
+    const modoBilateral = modoBilateralInput ? modoBilateralInput.checked : false;
 
     if (!arquivoInput.files[0]) {
         alert('Por favor, selecione uma imagem primeiro');
@@ -199,28 +206,44 @@ async function processarImagem() {
     document.body.classList.add('processing');
 
     try {
-        //SIMULAR PROGRESSO
-        await simularProgresso();
+        // Reduzir e recomprimir a foto no navegador antes do envio
+        atualizarProgresso(5, 'Preparando imagem...');
+        const config = await obterConfigEntrada();
+        const imagemEnvio = await prepararImagemParaUpload(arquivoInput.files[0], config);
         
         const formData = new FormData();
-        formData.append('imagem', arquivoInput.files[0]);
+        formData.append('imagem', imagemEnvio, imagemEnvio.name || arquivoInput.files[0].name);
         formData.append('paciente_id', pacienteAtual || '');
         formData.append('modo_manual', modoManual.toString());
-
-        atualizarProgresso(60, 'Enviando imagem para análise...');
-
-        const response = await fetch(`${API_BASE}/processar-imagem`, {
-            method: 'POST',
-            body: formData
+        formData.append('modo_bilateral', modoBilateral.toString());
+        // O overlay das medidas é desenhado aqui, sobre a foto local
+        formData.append('overlay_cliente', 'true');
+
+        // Progresso real do envio (10% a 70%); depois aguarda a análise no servidor
+        const resultado = await enviarComProgresso(`${API_BASE}/processar-imagem`, formData, (enviado, total) => {
+            const percent = 10 + Math.round((enviado / total) * 60);
+            atualizarProgresso(percent, `Enviando imagem... ${(enviado / 1024).toFixed(0)} de ${(total / 1024).toFixed(0)} KB`);
+            if (enviado >= total) {
+                atualizarProgresso(75, 'Analisando imagem e calculando medidas...');
+            }
         });
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        atualizarProgresso(90, 'Desenhando medidas...');
+
+        // Desenhar o overlay localmente a partir da geometria devolvida pelo backend
+        const overlays = resultado.maos && resultado.maos.length > 1
+            ? resultado.maos.filter(mao => mao.overlay).map(mao => ({
+                overlay: mao.overlay,
+                rotulo: mao.handedness === 'Right' ? 'Direita' : 'Esquerda'
+            }))
+            : (resultado.overlay ? [{ overlay: resultado.overlay }] : []);
+        if (!resultado.imagem_processada && overlays.length) {
+            try {
+                resultado.imagem_processada = await renderizarOverlay(arquivoInput.files[0], overlays);
+            } catch (erro) {
+                console.error('Erro ao desenhar overlay:', erro);
+            }
         }
-
-        atualizarProgresso(80, 'Processando medidas...');
-
-        const resultado = await response.json();
         
         atualizarProgresso(100, 'Processamento concluído!');
 
@@ -249,19 +272,171 @@ async function processarImagem() {
     }
 }
 
-//FUNÇÃO PARA SIMULAR PROGRESSO
-function simularProgresso() {
-    return new Promise(resolve => {
-        let progress = 0;
-        const interval = setInterval(() => {
-            progress += 2;
-            if (progress <= 50) {
-                atualizarProgresso(progress, 'Preparando análise...');
+// ===== OVERLAY DAS MEDIDAS (desenhado no navegador) =====
+const MAX_DIM_OVERLAY = 1000;
+
+function carregarImagemLocal(arquivo) {
+    return new Promise((resolve, reject) => {
+        const url = URL.createObjectURL(arquivo);
+        const img = new Image();
+        img.onload = () => {
+            URL.revokeObjectURL(url);
+            resolve(img);
+        };
+        img.onerror = () => {
+            URL.revokeObjectURL(url);
+            reject(new Error('Não foi possível ler a imagem local'));
+        };
+        img.src = url;
+    });
+}
+
+// Desenha contorno do quadrado, linhas de medida e landmarks (coordenadas 0-1)
+// sobre a foto local, com as mesmas cores do desenho que era feito no servidor
+async function renderizarOverlay(arquivo, overlays) {
+    const img = await carregarImagemLocal(arquivo);
+    const fator = Math.min(1, MAX_DIM_OVERLAY / Math.max(img.naturalWidth, img.naturalHeight));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(img.naturalWidth * fator);
+    canvas.height = Math.round(img.naturalHeight * fator);
+
+    const ctx = canvas.getContext('2d');
+    ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+    const px = ponto => [ponto[0] * canvas.width, ponto[1] * canvas.height];
+
+    overlays.forEach(({ overlay, rotulo }, i) => {
+        if (overlay.contorno_quadrado) {
+            ctx.strokeStyle = '#000000';
+            ctx.lineWidth = 3;
+            ctx.beginPath();
+            overlay.contorno_quadrado.forEach((ponto, j) => {
+                const [x, y] = px(ponto);
+                if (j === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+            });
+            ctx.closePath();
+            ctx.stroke();
+        }
+
+        ctx.font = 'bold 16px Arial';
+        overlay.segmentos.forEach(segmento => {
+            const [x1, y1] = px(segmento.de);
+            const [x2, y2] = px(segmento.ate);
+            ctx.strokeStyle = segmento.cor;
+            ctx.fillStyle = segmento.cor;
+            ctx.lineWidth = 3;
+            ctx.beginPath();
+            ctx.moveTo(x1, y1);
+            ctx.lineTo(x2, y2);
+            ctx.stroke();
+            ctx.fillText(`${segmento.rotulo}: ${segmento.valor_cm.toFixed(2)}cm`, (x1 + x2) / 2 + 10, (y1 + y2) / 2 - 10);
+        });
+
+        overlay.landmarks.forEach((ponto, j) => {
+            const [x, y] = px(ponto);
+            ctx.fillStyle = '#ff0000';
+            ctx.beginPath();
+            ctx.arc(x, y, 4, 0, 2 * Math.PI);
+            ctx.fill();
+            ctx.fillStyle = '#ffffff';
+            ctx.font = '9px Arial';
+            ctx.fillText(String(j), x - 5, y - 5);
+        });
+
+        const yInfo = 30 + 90 * i;
+        ctx.fillStyle = '#ff0000';
+        ctx.font = 'bold 16px Arial';
+        ctx.fillText(`Tamanho${rotulo ? ` (${rotulo})` : ''}: ${overlay.tamanho_ortese}`, 10, yInfo);
+        ctx.font = '13px Arial';
+        ctx.fillText(`Escala: ${overlay.escala_px_cm.toFixed(2)} px/cm`, 10, yInfo + 30);
+    });
+
+    return canvas.toDataURL('image/jpeg', 0.9);
+}
+
+// ===== PREPARAÇÃO E ENVIO DA IMAGEM =====
+const CONFIG_ENTRADA_PADRAO = { max_dim_entrada: 2000, formato_preferido: 'image/jpeg', qualidade_jpeg: 0.9 };
+let configEntrada = null;
+
+// Resolução preferida pelo backend (GET /api/config-entrada), buscada uma vez
+async function obterConfigEntrada() {
+    if (configEntrada) return configEntrada;
+    try {
+        const response = await fetch(`${API_BASE}/config-entrada`);
+        configEntrada = response.ok ? await response.json() : CONFIG_ENTRADA_PADRAO;
+    } catch (error) {
+        console.warn('Config de entrada indisponível, usando padrão:', error);
+        configEntrada = CONFIG_ENTRADA_PADRAO;
+    }
+    return configEntrada;
+}
+
+// Reduz a foto para o maior lado aceito pelo backend e recomprime em JPEG.
+// A orientação EXIF é aplicada no desenho, então o arquivo enviado já vai "em pé".
+async function prepararImagemParaUpload(arquivo, config) {
+    const maxDim = config.max_dim_entrada || CONFIG_ENTRADA_PADRAO.max_dim_entrada;
+    const tipo = config.formato_preferido || CONFIG_ENTRADA_PADRAO.formato_preferido;
+    const qualidade = config.qualidade_jpeg || CONFIG_ENTRADA_PADRAO.qualidade_jpeg;
+
+    if (typeof createImageBitmap !== 'function') return arquivo;
+
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(arquivo, { imageOrientation: 'from-image' });
+    } catch (error) {
+        console.warn('Não foi possível reduzir a imagem no navegador, enviando original:', error);
+        return arquivo;
+    }
+
+    const fator = Math.min(1, maxDim / Math.max(bitmap.width, bitmap.height));
+    const largura = Math.round(bitmap.width * fator);
+    const altura = Math.round(bitmap.height * fator);
+
+    let blob;
+    if (typeof OffscreenCanvas !== 'undefined') {
+        const canvas = new OffscreenCanvas(largura, altura);
+        canvas.getContext('2d').drawImage(bitmap, 0, 0, largura, altura);
+        blob = await canvas.convertToBlob({ type: tipo, quality: qualidade });
+    } else {
+        const canvas = document.createElement('canvas');
+        canvas.width = largura;
+        canvas.height = altura;
+        canvas.getContext('2d').drawImage(bitmap, 0, 0, largura, altura);
+        blob = await new Promise(resolve => canvas.toBlob(resolve, tipo, qualidade));
+    }
+    bitmap.close();
+
+    // Se a recompressão não ajudou (foto já pequena), manter o original
+    if (!blob || (fator === 1 && blob.size >= arquivo.size)) return arquivo;
+
+    console.log(`Imagem reduzida: ${(arquivo.size / 1024).toFixed(0)} KB -> ${(blob.size / 1024).toFixed(0)} KB (${largura}x${altura})`);
+    const nome = arquivo.name.replace(/\.[^.]+$/, '') + '.jpg';
+    return new File([blob], nome, { type: tipo });
+}
+
+// POST com progresso real do upload (fetch não expõe esse evento)
+function enviarComProgresso(url, formData, aoProgredir) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open('POST', url);
+        xhr.upload.onprogress = evento => {
+            if (evento.lengthComputable) aoProgredir(evento.loaded, evento.total);
+        };
+        xhr.onload = () => {
+            let corpo = null;
+            try {
+                corpo = JSON.parse(xhr.responseText);
+            } catch (error) {
+                corpo = null;
+            }
+            if (xhr.status >= 200 && xhr.status < 300 && corpo) {
+                resolve(corpo);
             } else {
-                clearInterval(interval);
-                resolve();
+                const detalhe = corpo && corpo.erro ? corpo.erro : `status: ${xhr.status}`;
+                reject(new Error(`HTTP error! ${detalhe}`));
             }
-        }, 50);
+        };
+        xhr.onerror = () => reject(new Error('Falha de rede no envio da imagem'));
+        xhr.send(formData);
     });
 }
 
@@ -314,8 +489,30 @@ function exibirResultadosProcessamento(resultado) {
         }
     }
 
-    // Mão detectada
-    if (resultado.handedness) {
+    // Modo bilateral: medidas de cada mão
+    if (resultado.maos && resultado.maos.length > 1) {
+        const dimensoesDiv = document.getElementById('dimensoes');
+        dimensoesDiv.innerHTML = '';
+        resultado.maos.forEach(mao => {
+            const lado = mao.handedness === 'Right' ? 'Direita' : 'Esquerda';
+            let html = `<div style="margin-bottom: 8px;"><strong>Mão ${lado}</strong>`;
+            for (const [chave, valor] of Object.entries(mao.dimensoes)) {
+                html += `<div><strong>${chave}:</strong> ${valor}</div>`;
+            }
+            if (mao.stl_url) {
+                html += `<div><a href="${urlApi(mao.stl_url)}">📥 STL ${lado}</a>`;
+                if (mao.url_3mf) {
+                    html += ` · <a href="${urlApi(mao.url_3mf)}">3MF</a>`;
+                }
+                html += '</div>';
+            }
+            dimensoesDiv.innerHTML += html + '</div>';
+        });
+        if (resultado.aviso) {
+            dimensoesDiv.innerHTML += `<div style="color: #e67e22;"><strong>⚠️ ${resultado.aviso}</strong></div>`;
+        }
+    } else if (resultado.handedness) {
+        // Mão detectada
         document.getElementById('dimensoes').innerHTML += 
             `<div><strong>Mão Detectada:</strong> ${resultado.handedness}</div>`;
     }
@@ -344,7 +541,7 @@ function exibirResultadosProcessamento(resultado) {
     // Configurar download do STL
     const linkDownload = document.getElementById('link-download-stl');
     if (resultado.stl_url) {
-        linkDownload.href = resultado.stl_url;
+        linkDownload.href = urlApi(resultado.stl_url);
         linkDownload.style.display = 'inline-block';
         linkDownload.textContent = '📥 Baixar Órtese STL';
         console.log(`✅ STL disponível: ${resultado.stl_url}`);
@@ -353,6 +550,17 @@ function exibirResultadosProcessamento(resultado) {
         console.log('ℹ️ Nenhum STL disponível para download (funcionalidade futura)');
     }
 
+    // Download alternativo em 3MF (arquivo menor, mesma geometria)
+    const link3mf = document.getElementById('link-download-3mf');
+    if (link3mf) {
+        if (resultado.url_3mf) {
+            link3mf.href = urlApi(resultado.url_3mf);
+            link3mf.style.display = 'inline-block';
+        } else {
+            link3mf.style.display = 'none';
+        }
+    }
+
     document.getElementById('resultado-processamento').classList.remove('hidden');
     console.log("✅ Resultados exibidos com sucesso");
 }